@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+from typing import Callable
+
+# "auto" lets one worker per node run background tasks, "on"/"off" force it
+BACKGROUND_TASKS = os.getenv("BACKGROUND_TASKS", "auto")
+BACKGROUND_LOCK_FILE = os.getenv(
+    "BACKGROUND_LOCK_FILE", os.path.join(tempfile.gettempdir(), "media-backend-background.lock")
+)
+
+
+class BackgroundWorker:
+    """Runs periodic tasks in daemon threads, in at most one worker process.
+
+    With BACKGROUND_TASKS=auto the worker that takes an exclusive lock on
+    BACKGROUND_LOCK_FILE is the designated one. The lock goes away with the
+    process, so a restarted worker can take over.
+    """
+
+    def __init__(self):
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def acquire(self) -> bool:
+        """Return True if this process should run the background tasks."""
+        if BACKGROUND_TASKS == "off":
+            return False
+        if BACKGROUND_TASKS == "on":
+            return True
+
+        import fcntl
+
+        lock_file = open(BACKGROUND_LOCK_FILE, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def schedule(self, target: Callable[[], None], interval: float):
+        """Call target now and then every interval seconds until stop() is called."""
+        def run():
+            while not self._stop.is_set():
+                target()
+                self._stop.wait(interval)
+
+        thread = threading.Thread(target=run, name=target.__name__, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -9,7 +9,7 @@ DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://myuser:1234@db:5432/fasta
 engine = _sql.create_engine(DATABASE_URL)
 
 def init_db():
-    from app.database.models import Media, Artist, Album, User, Post
+    from app.database.models import Media, Artist, Album, User, Post, Fingerprint, FingerprintBand, DuplicatePair
     logging.info("Creating database tables...")
     Base.metadata.create_all(bind=engine)
     logging.info("Database tables created.")
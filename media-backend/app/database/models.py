@@ -1,7 +1,6 @@
 import datetime as _dt
 import sqlalchemy as _sql
 import sqlalchemy.orm as _orm
-import passlib.hash as _hash
 import app.database.database as _database
 
 class Media (_database.Base):
@@ -16,10 +15,46 @@ class Media (_database.Base):
     length = _sql.Column(_sql.Integer)
     genre = _sql.Column(_sql.String, nullable=True)
     cover_image = _sql.Column(_sql.String, nullable=True)  # New field for cover image
+    size = _sql.Column(_sql.BigInteger, nullable=True)  # Bytes the media file takes on disk
 
     artist = _orm.relationship("Artist", back_populates="media")
     album = _orm.relationship("Album", back_populates="media")
     user = _orm.relationship("User", back_populates="media")
+    fingerprint = _orm.relationship("Fingerprint", back_populates="media", uselist=False, cascade="all, delete-orphan")
+    fingerprint_bands = _orm.relationship("FingerprintBand", cascade="all, delete-orphan")
+    duplicate_pairs = _orm.relationship(
+        "DuplicatePair", foreign_keys="DuplicatePair.media_id", cascade="all, delete-orphan"
+    )
+    duplicate_of_pairs = _orm.relationship(
+        "DuplicatePair", foreign_keys="DuplicatePair.duplicate_id", cascade="all, delete-orphan"
+    )
+
+class Fingerprint (_database.Base):
+    __tablename__ = "fingerprint_table"
+
+    media_id = _sql.Column(_sql.Integer, _sql.ForeignKey('media_table.id'), primary_key=True)
+    users_id = _sql.Column(_sql.Integer, _sql.ForeignKey('users_table.id'), index=True)
+    vector = _sql.Column(_sql.LargeBinary, nullable=True)  # None when the track could not be decoded
+
+    media = _orm.relationship("Media", back_populates="fingerprint")
+
+class FingerprintBand (_database.Base):
+    __tablename__ = "fingerprint_band_table"
+    __table_args__ = (_sql.Index("ix_fingerprint_band_lookup", "users_id", "band", "hash"),)
+
+    media_id = _sql.Column(_sql.Integer, _sql.ForeignKey('media_table.id'), primary_key=True)
+    band = _sql.Column(_sql.SmallInteger, primary_key=True)
+    hash = _sql.Column(_sql.Integer, nullable=False)
+    users_id = _sql.Column(_sql.Integer, _sql.ForeignKey('users_table.id'), nullable=False)
+
+class DuplicatePair (_database.Base):
+    """Two tracks whose fingerprints matched when the later one was fingerprinted; media_id < duplicate_id."""
+    __tablename__ = "duplicate_pair_table"
+
+    media_id = _sql.Column(_sql.Integer, _sql.ForeignKey('media_table.id'), primary_key=True)
+    duplicate_id = _sql.Column(_sql.Integer, _sql.ForeignKey('media_table.id'), primary_key=True, index=True)
+    users_id = _sql.Column(_sql.Integer, _sql.ForeignKey('users_table.id'), nullable=False, index=True)
+    similarity = _sql.Column(_sql.Float, nullable=False)
 
 class Artist (_database.Base):
     __tablename__ = "artist_table"
@@ -46,11 +81,16 @@ class User (_database.Base):
     email = _sql.Column(_sql.String, unique=True, index=True)
     hashed_password = _sql.Column(_sql.String)
     date_created = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
+    storage_used = _sql.Column(_sql.BigInteger, default=0, nullable=False)
+    track_count = _sql.Column(_sql.Integer, default=0, nullable=False)
+    storage_quota = _sql.Column(_sql.BigInteger, nullable=True)  # None means the default quota
 
     media = _orm.relationship("Media", back_populates="user")
     posts = _orm.relationship("Post", back_populates="owner")
 
     def verify_password(self, password: str):
+        # passlib is only needed when someone logs in
+        import passlib.hash as _hash
         return _hash.bcrypt.verify(password, self.hashed_password)
 
 class Post (_database.Base):
@@ -1,4 +1,5 @@
 import datetime as _dt
+from typing import Optional
 import pydantic as _pydantic
 
 class _BaseModel(_pydantic.BaseModel):
@@ -26,6 +27,19 @@ class Media (_BaseMedia):
 class CreateMedia(_BaseMedia):
     pass
 
+class DuplicateTrack(_BaseModel):
+    id: int
+    title: str
+    artist_name: str
+    album_name: str
+    length: int
+    size: Optional[int] = None
+
+class DuplicateCluster(_BaseModel):
+    tracks: list[DuplicateTrack]
+    similarity: float
+    reclaimable_bytes: int
+
 class _BaseArtist(_BaseModel):
     name: str
 
@@ -54,6 +68,11 @@ class User (_UserBase):
 class UserCreate(_UserBase):
     password: str
 
+class Usage(_BaseModel):
+    storage_used: int
+    storage_quota: int
+    track_count: int
+
 class _PostBase(_BaseModel):
     post_text: str
 
@@ -1,16 +1,20 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable, Iterator
 from fastapi import Depends, HTTPException
 import fastapi as _fastapi
 import fastapi.security as _security
-import email_validator as _email_check
-import passlib.hash as _hash
 import jwt as _jwt
 oauth2schema = _security.OAuth2PasswordBearer("/api/token")
 import pydantic as _pydantic
+import sqlalchemy as _sql
+import datetime as _dt
 import app.database.database as _database
 import app.database.models as _models      
 import app.database.schemas as _schemas
 import os
+import hmac
+import time
+import base64
+import hashlib
 
 
 if TYPE_CHECKING:
@@ -18,6 +22,13 @@ if TYPE_CHECKING:
 
 _JWT_SECRET = os.getenv("JWT_SECRET", "thisisnotverysafe")
 
+# Stream URLs are signed with their own key so they cannot be replayed as JWTs
+_STREAM_URL_SECRET = os.getenv("STREAM_URL_SECRET", _JWT_SECRET + ":stream").encode()
+STREAM_URL_TTL = int(os.getenv("STREAM_URL_TTL", 3600))
+
+# Storage quota in bytes for users without an explicit storage_quota
+STORAGE_QUOTA = int(os.getenv("USER_STORAGE_QUOTA", 5 * 1024 ** 3))
+
 def _add_tables():
     return _database.Base.metadata.create_all(bind=_database.engine)
 
@@ -34,8 +45,11 @@ async def create_instance(model_instance: _pydantic.BaseModel, db: "Session") ->
     db.refresh(model_instance)
     return model_instance
 
-async def create_media(media: _schemas.CreateMedia, db: "Session") -> _schemas.Media:
-    media_instance = _models.Media(**media.dict())
+async def create_media(media: _schemas.CreateMedia, db: "Session", size: int = 0) -> _schemas.Media:
+    if not claim_storage(media.users_id, size, db):
+        db.rollback()
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+    media_instance = _models.Media(**media.dict(), size=size)
     return await create_instance(media_instance, db)
 
 async def create_artist(artist: _schemas.CreateArtist, db: "Session") -> _schemas.Artist:
@@ -60,6 +74,7 @@ async def get_artist(id: int, db: "Session"):
     return db.query(_models.Artist).filter(_models.Artist.id == id).first()
 
 async def delete_media(media: _models.Media, db: "Session"):
+    release_media_usage(media, db)
     db.delete(media)
     db.commit()
 
@@ -75,6 +90,83 @@ async def update_media(
 
     return _schemas.Media.from_orm(media)
 
+def _quota_expression():
+    return _sql.func.coalesce(_models.User.storage_quota, STORAGE_QUOTA)
+
+def _update_usage(user_id: int, db: "Session", size: int = 0, tracks: int = 0):
+    """Adjust the user's usage counters inside the caller's transaction."""
+    db.execute(
+        _sql.update(_models.User)
+        .where(_models.User.id == user_id)
+        .values(
+            storage_used=_models.User.storage_used + size,
+            track_count=_models.User.track_count + tracks,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def claim_storage(user_id: int, size: int, db: "Session") -> bool:
+    """Count a new track of size bytes against the user, returning False if it does not fit.
+
+    Runs inside the caller's transaction, so the counters only ever change
+    together with the media rows they count.
+    """
+    query = _sql.update(_models.User).where(_models.User.id == user_id)
+    if size:
+        query = query.where(_models.User.storage_used + size <= _quota_expression())
+    result = db.execute(
+        query.values(
+            storage_used=_models.User.storage_used + size,
+            track_count=_models.User.track_count + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def release_media_usage(media: _models.Media, db: "Session"):
+    """Subtract a media row from its owner's counters; commit together with the delete."""
+    _update_usage(media.users_id, db, size=-(media.size or 0), tracks=-1)
+
+def read_usage(user_id: int, db: "Session") -> _schemas.Usage:
+    storage_used, storage_quota, track_count = db.execute(
+        _sql.select(_models.User.storage_used, _quota_expression(), _models.User.track_count)
+        .where(_models.User.id == user_id)
+    ).one()
+    return _schemas.Usage(
+        storage_used=storage_used, storage_quota=storage_quota, track_count=track_count
+    )
+
+async def get_usage(user_id: int, db: "Session") -> _schemas.Usage:
+    return read_usage(user_id, db)
+
+def reconcile_usage(db: "Session"):
+    """Recompute every user's counters from their media rows.
+
+    Repairs counters that drifted, and fills them in for users who had media
+    before usage was tracked. Each user's row is locked while it is counted,
+    so an upload or delete committing at the same time is never lost.
+    """
+    media = _models.Media
+    user_ids = db.scalars(_sql.select(_models.User.id)).all()
+    for user_id in user_ids:
+        current = db.execute(
+            _sql.select(_models.User.storage_used, _models.User.track_count)
+            .where(_models.User.id == user_id)
+            .with_for_update()
+        ).one_or_none()
+        counted = db.execute(
+            _sql.select(_sql.func.coalesce(_sql.func.sum(media.size), 0), _sql.func.count(media.id))
+            .where(media.users_id == user_id)
+        ).one()
+        if current is not None and tuple(current) != tuple(counted):
+            db.execute(
+                _sql.update(_models.User)
+                .where(_models.User.id == user_id)
+                .values(storage_used=counted[0], track_count=counted[1])
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+
 async def get_user_by_email(
     email: str,
     db: "Session"
@@ -85,6 +177,9 @@ async def create_user(
     user: _schemas.UserCreate, 
     db: "Session"
 ):
+    # Validation and hashing modules are only loaded when a user registers
+    import email_validator as _email_check
+    import passlib.hash as _hash
 # check that email is valid
     try: 
         # Validate email
@@ -108,6 +203,29 @@ async def create_token(user: _models.User):
     token = _jwt.encode(user_dict, _JWT_SECRET, algorithm="HS256")
     return dict(access_token=token, token_type="bearer")
 
+def _stream_signature(key: str, size: int, expires: int) -> str:
+    message = f"{key}\n{size}\n{expires}".encode()
+    digest = hmac.new(_STREAM_URL_SECRET, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def create_stream_signature(key: str, size: int) -> dict:
+    """Sign a storage key and its size for STREAM_URL_TTL seconds."""
+    expires = int(time.time()) + STREAM_URL_TTL
+    return dict(size=size, expires=expires, signature=_stream_signature(key, size, expires))
+
+def verify_stream_signature(key: str, size: int, expires: int, signature: str) -> bool:
+    """Check a stream URL without touching the database."""
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_stream_signature(key, size, expires), signature)
+
+def get_token_user_id(token: str):
+    """Return the id of the user a token was issued to, or None if it is not valid."""
+    try:
+        return int(_jwt.decode(token, _JWT_SECRET, algorithms=["HS256"])["id"])
+    except (_jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+
 async def authenticate_user(email: str, password: str, db: "Session"):
     user = await get_user_by_email(email=email, db=db)
     if not user or not user.verify_password(password=password):
@@ -151,4 +269,298 @@ async def get_or_create_artist(artist_name: str, db: "Session") -> _models.Artis
     return await get_or_create_entity(_models.Artist, artist_name, db)
 
 async def get_or_create_album(album_name: str, db: "Session") -> _models.Album:
-    return await get_or_create_entity(_models.Album, album_name, db)
\ No newline at end of file
+    return await get_or_create_entity(_models.Album, album_name, db)
+
+# Columns shared by the library export and import formats
+LIBRARY_FIELDS = ["title", "artist_name", "album_name", "time", "length", "genre", "cover_image"]
+
+def iter_library_rows(user_id: int, db: "Session", batch_size: int = 1000) -> Iterator[dict]:
+    """Yield the user's library metadata one row at a time from a server-side cursor."""
+    query = (
+        db.query(
+            _models.Media.title,
+            _models.Artist.name,
+            _models.Album.name,
+            _models.Media.time,
+            _models.Media.length,
+            _models.Media.genre,
+            _models.Media.cover_image,
+        )
+        .join(_models.Artist, _models.Media.artist_id == _models.Artist.id)
+        .join(_models.Album, _models.Media.album_id == _models.Album.id)
+        .filter(_models.Media.users_id == user_id)
+        .order_by(_models.Media.id)
+        .yield_per(batch_size)
+    )
+    for title, artist_name, album_name, time, length, genre, cover_image in query:
+        yield {
+            "title": title,
+            "artist_name": artist_name,
+            "album_name": album_name,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ") if time else None,
+            "length": length or 0,
+            "genre": genre,
+            "cover_image": cover_image,
+        }
+
+def _get_or_create_ids(entity_class, names: set, db: "Session") -> dict:
+    """Map names to ids for a batch, inserting the names that do not exist yet."""
+    def lookup():
+        rows = db.execute(
+            _sql.select(entity_class.id, entity_class.name).where(entity_class.name.in_(names))
+        )
+        return {name: id for id, name in rows}
+
+    ids = lookup()
+    missing = names - ids.keys()
+    if missing:
+        db.execute(_sql.insert(entity_class), [{"name": name} for name in missing])
+        ids = lookup()
+    return ids
+
+def _parse_library_time(value) -> _dt.datetime:
+    if not value:
+        return _dt.datetime.utcnow()
+    return _dt.datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+
+def _import_library_batch(batch: list, user_id: int, db: "Session") -> int:
+    titles = {row["title"] for row in batch}
+    existing = {
+        title for (title,) in db.execute(
+            _sql.select(_models.Media.title).where(
+                _models.Media.users_id == user_id, _models.Media.title.in_(titles)
+            )
+        )
+    }
+    artist_ids = _get_or_create_ids(_models.Artist, {row["artist_name"] for row in batch}, db)
+    album_ids = _get_or_create_ids(_models.Album, {row["album_name"] for row in batch}, db)
+
+    media_rows = []
+    for row in batch:
+        if row["title"] in existing:
+            continue
+        existing.add(row["title"])
+        media_rows.append({
+            "title": row["title"],
+            "artist_id": artist_ids[row["artist_name"]],
+            "album_id": album_ids[row["album_name"]],
+            "time": row["time"],
+            "users_id": user_id,
+            "length": row["length"],
+            "genre": row["genre"],
+            "cover_image": row["cover_image"],
+            "size": row["size"],
+        })
+    if media_rows:
+        db.execute(_sql.insert(_models.Media), media_rows)
+        _update_usage(user_id, db, size=sum(row["size"] for row in media_rows), tracks=len(media_rows))
+    return len(media_rows)
+
+# Titles of missing files listed in an import's response
+MISSING_REPORT_LIMIT = 100
+
+def import_library_rows(
+    rows: Iterable[dict], user_id: int, db: "Session", stored_sizes: dict, batch_size: int = 1000
+) -> dict:
+    """Insert exported library rows in batches, reusing existing artist and album rows.
+
+    An export only holds metadata, so a row is imported only when the user's
+    storage already has its file; stored_sizes maps those file names to their
+    sizes. Rows without a file are reported as missing rather than imported,
+    since cleanup_orphaned_entries would delete them. Rows whose title already
+    exists in the user's library are skipped, the same way upload_files skips
+    files that are already present.
+
+    Batches are written as they fill up but committed only once the last row
+    has been read, so an invalid record anywhere in the file leaves the
+    library untouched.
+    """
+    imported = 0
+    total = 0
+    missing = 0
+    missing_titles = []
+    batch = []
+    try:
+        for number, row in enumerate(rows, start=1):
+            try:
+                if not row.get("title"):
+                    raise ValueError("title is required")
+                batch.append({
+                    "title": row["title"],
+                    "artist_name": row.get("artist_name") or "Unknown Artist",
+                    "album_name": row.get("album_name") or "Unknown Album",
+                    "time": _parse_library_time(row.get("time")),
+                    "length": int(row.get("length") or 0),
+                    "genre": row.get("genre") or "Unknown Genre",
+                    "cover_image": row.get("cover_image") or "static_files/default_cover.png",
+                })
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise _fastapi.HTTPException(
+                    status_code=400, detail=f"Invalid library record {number}"
+                )
+            total = number
+            record = batch[-1]
+            if record["title"] not in stored_sizes:
+                batch.pop()
+                missing += 1
+                if len(missing_titles) < MISSING_REPORT_LIMIT:
+                    missing_titles.append(record["title"])
+                continue
+            record["size"] = stored_sizes[record["title"]]
+            if len(batch) >= batch_size:
+                imported += _import_library_batch(batch, user_id, db)
+                batch = []
+        if batch:
+            imported += _import_library_batch(batch, user_id, db)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return {
+        "imported": imported,
+        "skipped": total - imported - missing,
+        "missing": missing,
+        "missing_titles": missing_titles,
+    }
+
+def get_unfingerprinted_media(db: "Session", limit: int, after_id: int = 0) -> list:
+    """Return (id, users_id, title) for up to limit tracks after after_id that have no fingerprint yet."""
+    return db.execute(
+        _sql.select(_models.Media.id, _models.Media.users_id, _models.Media.title)
+        .outerjoin(_models.Fingerprint, _models.Fingerprint.media_id == _models.Media.id)
+        .where(_models.Fingerprint.media_id.is_(None), _models.Media.id > after_id)
+        .order_by(_models.Media.id)
+        .limit(limit)
+    ).all()
+
+def save_fingerprint(media_id: int, users_id: int, vector: bytes, bands: list, db: "Session"):
+    """Store a fingerprint, its LSH band hashes and the duplicates it matches.
+
+    vector is None for tracks that cannot be decoded. Otherwise the tracks that
+    share one of its buckets are compared with it here, once, so that
+    find_duplicate_clusters only has to read the stored pairs.
+    """
+    db.add(_models.Fingerprint(media_id=media_id, users_id=users_id, vector=vector))
+    for band, hash in enumerate(bands):
+        db.add(_models.FingerprintBand(media_id=media_id, band=band, hash=hash, users_id=users_id))
+    if vector is not None:
+        for other_id, similarity in _match_fingerprint(media_id, users_id, vector, bands, db):
+            db.add(_models.DuplicatePair(
+                media_id=min(media_id, other_id), duplicate_id=max(media_id, other_id),
+                users_id=users_id, similarity=similarity,
+            ))
+    try:
+        db.commit()
+    except _sql.exc.IntegrityError:
+        # The track was deleted while it was being fingerprinted
+        db.rollback()
+
+def _match_fingerprint(media_id: int, users_id: int, vector: bytes, bands: list, db: "Session") -> list:
+    """Return (media_id, similarity) for the user's tracks that share a bucket with vector and match it."""
+    import numpy as np
+    import app.fingerprint as _fingerprint
+
+    band = _models.FingerprintBand
+    # Only the track's own buckets are looked up. Each term repeats users_id so
+    # that it is one ix_fingerprint_band_lookup seek instead of a scan of the
+    # user's bands.
+    candidates = (
+        _sql.select(band.media_id)
+        .where(
+            _sql.or_(*(
+                (band.users_id == users_id) & (band.band == index) & (band.hash == hash)
+                for index, hash in enumerate(bands)
+            )),
+            band.media_id != media_id,
+        )
+        .distinct()
+    )
+    rows = db.execute(
+        _sql.select(_models.Fingerprint.media_id, _models.Fingerprint.vector)
+        .where(_models.Fingerprint.media_id.in_(candidates), _models.Fingerprint.vector.is_not(None))
+    ).all()
+    if not rows:
+        return []
+    similarities = np.stack([_fingerprint.from_bytes(other) for _, other in rows]) @ _fingerprint.from_bytes(vector)
+    return [
+        (other_id, float(similarity)) for (other_id, _), similarity in zip(rows, similarities)
+        if similarity >= _fingerprint.SIMILARITY_THRESHOLD
+    ]
+
+def find_duplicate_clusters(user_id: int, db: "Session", max_length_difference: int = 2) -> list[_schemas.DuplicateCluster]:
+    """Cluster the user's tracks that sound the same.
+
+    Reads the pairs save_fingerprint stored, keeping those at least
+    SIMILARITY_THRESHOLD similar whose lengths match within
+    max_length_difference seconds.
+    """
+    import app.fingerprint as _fingerprint
+
+    pair = _models.DuplicatePair
+    pairs = db.execute(
+        _sql.select(pair.media_id, pair.duplicate_id, pair.similarity)
+        .where(pair.users_id == user_id, pair.similarity >= _fingerprint.SIMILARITY_THRESHOLD)
+    ).all()
+    if not pairs:
+        return []
+
+    media_ids = {media_id for first, second, _ in pairs for media_id in (first, second)}
+    rows = db.execute(
+        _sql.select(
+            _models.Media.id,
+            _models.Media.title,
+            _models.Artist.name,
+            _models.Album.name,
+            _models.Media.length,
+            _models.Media.size,
+        )
+        .join(_models.Artist, _models.Media.artist_id == _models.Artist.id)
+        .join(_models.Album, _models.Media.album_id == _models.Album.id)
+        .where(_models.Media.id.in_(media_ids))
+    ).all()
+    tracks = {
+        id: _schemas.DuplicateTrack(
+            id=id, title=title, artist_name=artist_name, album_name=album_name,
+            length=length or 0, size=size,
+        )
+        for id, title, artist_name, album_name, length, size in rows
+    }
+
+    # Union-find over the stored pairs
+    parents = {}
+    def find(media_id):
+        parents.setdefault(media_id, media_id)
+        while parents[media_id] != media_id:
+            parents[media_id] = parents[parents[media_id]]
+            media_id = parents[media_id]
+        return media_id
+
+    kept = []
+    for first, second, similarity in pairs:
+        if first not in tracks or second not in tracks:
+            continue
+        if abs(tracks[first].length - tracks[second].length) > max_length_difference:
+            continue
+        root_first, root_second = find(first), find(second)
+        if root_first != root_second:
+            parents[root_second] = root_first
+        kept.append((first, similarity))
+
+    lowest_similarity = {}
+    for first, similarity in kept:
+        root = find(first)
+        lowest_similarity[root] = min(lowest_similarity.get(root, 1.0), similarity)
+
+    clusters = {}
+    for media_id in parents:
+        clusters.setdefault(find(media_id), []).append(tracks[media_id])
+
+    result = []
+    for root, members in clusters.items():
+        sizes = [track.size or 0 for track in members]
+        result.append(_schemas.DuplicateCluster(
+            tracks=sorted(members, key=lambda track: track.id),
+            similarity=lowest_similarity[root],
+            reclaimable_bytes=sum(sizes) - max(sizes),
+        ))
+    return sorted(result, key=lambda cluster: cluster.reclaimable_bytes, reverse=True)
@@ -1,61 +1,86 @@
 import os
 import re
-from typing import TYPE_CHECKING, List
-from fastapi.responses import FileResponse, StreamingResponse
+import io
+import csv
+import json
+import mimetypes
+import importlib
+import contextlib
+import shutil
+from typing import TYPE_CHECKING, Iterator, List
+from urllib.parse import quote
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 import fastapi as _fastapi
 import sqlalchemy.orm as _orm
 from sqlalchemy.orm import joinedload
+import sqlalchemy as _sql
 from sqlalchemy import or_
 import fastapi.security as _security
 import datetime as _dt
-import threading
-import time
-import mutagen
-from mutagen.mp4 import MP4
-from mutagen.mp3 import MP3
-from mutagen.flac import FLAC
-from mutagen.wavpack import WavPack
-from mutagen.aac import AAC
 from app.database import schemas as _schemas
 from app.database import services as _services
 from app.database import models as _models, database as _database
+from app import storage as _storage
+from app.background import BackgroundWorker
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 
 
 if TYPE_CHECKING:
     from sqlalchemy.orm import Session
 
-app = _fastapi.FastAPI()
+router = _fastapi.APIRouter()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"], 
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Base directory for users uploads
+# URL prefix cover images are served under; tracks are only streamed through signed URLs
 UPLOAD_DIR = "users_media"
-
-# Ensure the base upload directory exists
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-
-app.mount("/static_files", StaticFiles(directory="static_files"), name="static_files")
-app.mount("/users_media", StaticFiles(directory="users_media"), name="users_media")
-
-@app.on_event("startup")
-def on_startup():
-   _database.init_db()
-
-
-#Helper function to het the user's upload directory
-def get_user_upload_dir(user_id: int) -> str:
-    user_dir = os.path.join(UPLOAD_DIR, f"id_{user_id}_media")
-    os.makedirs(user_dir, exist_ok=True)
-    return user_dir
+# Suffix of the cover images extracted from uploads, the only files served publicly
+COVER_SUFFIX = "_cover.jpg"
+
+# Hand signed streams to the front proxy: "", "x-accel-redirect" or "x-sendfile"
+STREAM_OFFLOAD = os.getenv("STREAM_OFFLOAD", "")
+# Internal proxy location that maps onto the media store, for X-Accel-Redirect
+STREAM_ACCEL_PREFIX = os.getenv("STREAM_ACCEL_PREFIX", "/protected_media/")
+# Size of the chunks streamed responses are read in
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Seconds between two sweeps of cleanup_orphaned_entries
+CLEANUP_INTERVAL = int(os.getenv("CLEANUP_INTERVAL", 3600))
+# Media rows fetched per round trip by the sweep
+CLEANUP_BATCH_SIZE = 1000
+
+# Seconds between two runs of fingerprint_pending_media, and tracks handled per run
+FINGERPRINT_INTERVAL = int(os.getenv("FINGERPRINT_INTERVAL", 30))
+FINGERPRINT_BATCH_SIZE = int(os.getenv("FINGERPRINT_BATCH_SIZE", 50))
+
+# Mutagen classes per extension, imported on first upload to keep worker startup light
+AUDIO_READERS = {
+    ".m4a": ("mutagen.mp4", "MP4"),
+    ".mp3": ("mutagen.mp3", "MP3"),
+    ".wav": ("mutagen.wavpack", "WavPack"),
+    ".flac": ("mutagen.flac", "FLAC"),
+    ".aac": ("mutagen.aac", "AAC"),
+}
+
+def load_audio(extension: str, fileobj):
+    module_name, class_name = AUDIO_READERS[extension]
+    reader = getattr(importlib.import_module(module_name), class_name)
+    return reader(fileobj)
+
+
+#Helper function to get the storage key of a file in the user's library
+def get_media_key(user_id: int, filename: str) -> str:
+    if "/" in filename:
+        raise ValueError(f"Invalid file name: {filename!r}")
+    return _storage.validate_key(f"id_{user_id}_media/{filename}")
+
+def get_media_url(key: str) -> str:
+    return f"{UPLOAD_DIR}/{key}"
+
+def get_key_from_url(url: str):
+    """Return the storage key behind a users_media URL, or None for other paths."""
+    prefix = f"{UPLOAD_DIR}/"
+    return url[len(prefix):] if url and url.startswith(prefix) else None
 
 def reformat_datetime(dt: _dt) -> str:
     """Reformat a datetime object to 'YYYY-MM-DDTHH:MM:SSZ' format."""
@@ -66,138 +91,309 @@ def format_length(seconds: int) -> str:
     minutes, seconds = divmod(seconds, 60)
     return f"{minutes:02}:{seconds:02}"
 
-@app.get("/api")
+# Supported library export/import formats and their media types
+LIBRARY_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Number of rows encoded into a single chunk of the export stream
+EXPORT_CHUNK_ROWS = 500
+
+class _LineBuffer:
+    """File-like object that hands back whatever csv.writer writes to it."""
+    def write(self, value: str) -> str:
+        return value
+
+def encode_library_rows(rows: Iterator[dict], fmt: str) -> Iterator[str]:
+    """Encode library rows as NDJSON or CSV, yielding a few hundred rows per chunk."""
+    if fmt == "csv":
+        writer = csv.DictWriter(_LineBuffer(), fieldnames=_services.LIBRARY_FIELDS)
+        encode = writer.writerow
+        yield writer.writeheader()
+    else:
+        encode = lambda row: json.dumps(row, ensure_ascii=False) + "\n"
+
+    chunk = []
+    for row in rows:
+        chunk.append(encode(row))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+def decode_library_rows(stream, fmt: str) -> Iterator[dict]:
+    """Read library rows one line at a time from an NDJSON or CSV byte stream."""
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            yield from csv.DictReader(text)
+            return
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                raise _fastapi.HTTPException(
+                    status_code=400, detail=f"Invalid JSON on line {number}"
+                )
+    except (UnicodeDecodeError, csv.Error):
+        raise _fastapi.HTTPException(status_code=400, detail="Library file is not valid UTF-8 text")
+
+@router.get("/api")
 async def root():
     return {"message": "MyMedia"}
 
-@app.post("/api/upload/")
+async def save_upload(file: _fastapi.UploadFile, key: str, user_id: int, db: _orm.Session) -> int:
+    """Store a spooled upload and return its size, refusing it with 413 if it cannot fit.
+
+    The bytes are counted against the quota when the media row is created,
+    where services.create_media checks the quota again atomically.
+    """
+    size = file.size
+    if size is None:
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+
+    usage = _services.read_usage(user_id, db)
+    if usage.storage_used + size > usage.storage_quota:
+        raise _fastapi.HTTPException(status_code=413, detail="Storage quota exceeded")
+
+    file.file.seek(0)
+    return await run_in_threadpool(_storage.get_storage().put, key, file.file)
+
+def save_cover_image(key: str, data: bytes) -> str:
+    """Store an extracted cover image next to its track and return its URL."""
+    cover_key = f"{os.path.splitext(key)[0]}{COVER_SUFFIX}"
+    _storage.get_storage().put(cover_key, io.BytesIO(data))
+    return get_media_url(cover_key)
+
+def get_remaining_storage(user_id: int):
+    """Return how many bytes the user can still store, or None for unknown users."""
+    db = _database.SessionLocal()
+    try:
+        usage = _services.read_usage(user_id, db)
+    except _orm.exc.NoResultFound:
+        return None
+    finally:
+        db.close()
+    return usage.storage_quota - usage.storage_used
+
+class UploadQuotaMiddleware:
+    """Stops an upload as soon as its body cannot fit in the user's quota.
+
+    FastAPI parses a multipart body, spooling every file, before dependencies
+    or the endpoint run, so the quota is enforced here while the body comes
+    in. A Content-Length that does not fit is refused before anything is
+    read, and the body is cut off with a 413 once it goes over, which also
+    covers chunked uploads. Requests without a valid token are refused here
+    for the same reason.
+    """
+    def __init__(self, app, path: str = "/api/upload/"):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        headers = _fastapi.datastructures.Headers(scope=scope)
+        declared_length = headers.get("content-length")
+        if declared_length is not None and not declared_length.isdigit():
+            response = JSONResponse({"detail": "Invalid Content-Length header"}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        user_id = _services.get_token_user_id(token) if scheme.lower() == "bearer" else None
+        remaining = None if user_id is None else await run_in_threadpool(get_remaining_storage, user_id)
+        if remaining is None:
+            response = JSONResponse(
+                {"detail": "Not authenticated"}, status_code=401, headers={"WWW-Authenticate": "Bearer"}
+            )
+            await response(scope, receive, send)
+            return
+        if declared_length is not None and int(declared_length) > remaining:
+            response = JSONResponse({"detail": "Storage quota exceeded"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_within_quota():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > remaining:
+                    # FastAPI passes HTTPExceptions raised while parsing the body through
+                    raise _fastapi.HTTPException(status_code=413, detail="Storage quota exceeded")
+            return message
+
+        await self.app(scope, receive_within_quota, send)
+
+@router.post("/api/upload/")
 async def upload_files(
     files: List[_fastapi.UploadFile] = _fastapi.File(...),
     user: _schemas.User = _fastapi.Depends(_services.get_current_user),
     db: _orm.Session = _fastapi.Depends(_services.get_db)
 ):
-    user_dir = get_user_upload_dir(user.id)
+    # The request's Content-Length was checked by UploadQuotaMiddleware before the body was parsed
+    storage = _storage.get_storage()
     uploaded_files = []
 
     for file in files:
-        file_path = os.path.join(user_dir, file.filename)
+        try:
+            key = get_media_key(user.id, file.filename)
+        except ValueError:
+            raise _fastapi.HTTPException(status_code=400, detail="Invalid file name")
 
-        if os.path.exists(file_path):
+        if await run_in_threadpool(storage.exists, key):
             continue
 
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-
-        print(f"File saved to {file_path}")
-
-        supported_extensions = [".m4a", ".mp3", ".wav", ".flac", ".aac"]
+        # Files that never get a media row cannot be accounted for, so they are not stored
         file_extension = os.path.splitext(file.filename)[1].lower()
-
-        if file_extension not in supported_extensions:
+        if file_extension not in AUDIO_READERS:
             continue
 
+        filename = file.filename
+        file_size = await save_upload(file, key, user.id, db)
+        print(f"File saved to {key}")
+
+        cover_image = None
         try:
-            audio = None
-            cover_image = None
-            if file_extension == ".m4a":
-                audio = MP4(file_path)
-                if 'covr' in audio:
-                    cover_image = os.path.join(user_dir, f"{os.path.splitext(file.filename)[0]}_cover.jpg")
-                    with open(cover_image, "wb") as img_file:
-                        img_file.write(audio['covr'][0])
-                    print(f"Extracted cover image for .m4a: {cover_image}")
-            elif file_extension == ".mp3":
-                audio = MP3(file_path)
-                for tag in audio.tags.keys():
-                    if tag.startswith('APIC:'):
-                        cover_image = os.path.join(user_dir, f"{os.path.splitext(file.filename)[0]}_cover.jpg")
-                        with open(cover_image, "wb") as img_file:
-                            img_file.write(audio.tags[tag].data)
-                        print(f"Extracted cover image")
-                        break
-                artist_name = audio.get('TPE1', ["Unknown Artist"])[0]
-                album_name = audio.get('TALB', ["Unknown Album"])[0]
-                genre = audio.get('TCON', ["Unknown Genre"])[0]
-            elif file_extension == ".wav":
-                audio = WavPack(file_path)
-            elif file_extension == ".flac":
-                audio = FLAC(file_path)
-                if audio.pictures:
-                    cover_image = os.path.join(user_dir, f"{os.path.splitext(file.filename)[0]}_cover.jpg")
-                    with open(cover_image, "wb") as img_file:
-                        img_file.write(audio.pictures[0].data)
-                    print(f"Extracted cover image for .flac: {cover_image}")
-            elif file_extension == ".aac":
-                audio = AAC(file_path)
-
-            filename = file.filename
-            if file_extension != ".mp3":
-                artist_name = audio.tags.get('\xa9ART', ["Unknown Artist"])[0] if '\xa9ART' in audio.tags else "Unknown Artist"
-                album_name = audio.tags.get('\xa9alb', ["Unknown Album"])[0] if '\xa9alb' in audio.tags else "Unknown Album"
-                genre = audio.tags.get('\xa9gen', ["Unknown Genre"])[0] if '\xa9gen' in audio.tags else "Unknown Genre"
-            length = int(audio.info.length) if hasattr(audio.info, 'length') else 0
-
-            print(f"Artist Name: {artist_name}")
-            print(f"Album Name: {album_name}")
-            print(f"Length: {length}")
-            print(f"Genre: {genre}")
-            
-        except Exception as e:
-            print(f"Error extracting metadata: {e}")
-            artist_name = "Unknown Artist"
-            album_name = "Unknown Album"
-            length = 0
-            genre = "Unknown Genre"
-            cover_image = None
-
-        if not cover_image:
-            cover_image = "static_files/default_cover.png"
-            print("No cover image found, using default cover image")
-
-        artist = await _services.get_or_create_artist(artist_name=artist_name, db=db)
-        album = await _services.get_or_create_album(album_name=album_name, db=db)
-
-        media_data = _schemas.CreateMedia(
-            title=filename,
-            artist_id=artist.id,
-            time=_dt.datetime.utcnow(),
-            album_id=album.id,
-            users_id=user.id,
-            length=length,
-            genre=genre,
-            cover_image=cover_image
-        )
-        await _services.create_media(media=media_data, db=db)
+            # Metadata is read from the spooled upload, so remote backends are not read back
+            file.file.seek(0)
+            try:
+                audio = load_audio(file_extension, file.file)
+                if file_extension == ".m4a":
+                    if 'covr' in audio:
+                        cover_image = await run_in_threadpool(save_cover_image, key, audio['covr'][0])
+                        print(f"Extracted cover image for .m4a: {cover_image}")
+                elif file_extension == ".mp3":
+                    for tag in audio.tags.keys():
+                        if tag.startswith('APIC:'):
+                            cover_image = await run_in_threadpool(save_cover_image, key, audio.tags[tag].data)
+                            print(f"Extracted cover image")
+                            break
+                    artist_name = audio.get('TPE1', ["Unknown Artist"])[0]
+                    album_name = audio.get('TALB', ["Unknown Album"])[0]
+                    genre = audio.get('TCON', ["Unknown Genre"])[0]
+                elif file_extension == ".flac":
+                    if audio.pictures:
+                        cover_image = await run_in_threadpool(save_cover_image, key, audio.pictures[0].data)
+                        print(f"Extracted cover image for .flac: {cover_image}")
+
+                if file_extension != ".mp3":
+                    artist_name = audio.tags.get('\xa9ART', ["Unknown Artist"])[0] if '\xa9ART' in audio.tags else "Unknown Artist"
+                    album_name = audio.tags.get('\xa9alb', ["Unknown Album"])[0] if '\xa9alb' in audio.tags else "Unknown Album"
+                    genre = audio.tags.get('\xa9gen', ["Unknown Genre"])[0] if '\xa9gen' in audio.tags else "Unknown Genre"
+                length = int(audio.info.length) if hasattr(audio.info, 'length') else 0
+
+                print(f"Artist Name: {artist_name}")
+                print(f"Album Name: {album_name}")
+                print(f"Length: {length}")
+                print(f"Genre: {genre}")
+
+            except Exception as e:
+                print(f"Error extracting metadata: {e}")
+                artist_name = "Unknown Artist"
+                album_name = "Unknown Album"
+                length = 0
+                genre = "Unknown Genre"
+
+            if not cover_image:
+                cover_image = "static_files/default_cover.png"
+                print("No cover image found, using default cover image")
+
+            artist = await _services.get_or_create_artist(artist_name=artist_name, db=db)
+            album = await _services.get_or_create_album(album_name=album_name, db=db)
+
+            media_data = _schemas.CreateMedia(
+                title=filename,
+                artist_id=artist.id,
+                time=_dt.datetime.utcnow(),
+                album_id=album.id,
+                users_id=user.id,
+                length=length,
+                genre=genre,
+                cover_image=cover_image
+            )
+            await _services.create_media(media=media_data, db=db, size=file_size)
+        except BaseException:
+            # Without a media row nothing would ever account for the stored file,
+            # so remove it before reporting the error
+            db.rollback()
+            await run_in_threadpool(delete_upload, key, cover_image)
+            raise
         uploaded_files.append(media_data)
 
     return {"uploaded_files": uploaded_files}
 
-@app.get("/api/download/{filename}", response_class=FileResponse)
-async def download_file(
+def delete_upload(key: str, cover_image: str = None):
+    """Remove a stored upload and the cover image extracted from it, if any."""
+    storage = _storage.get_storage()
+    if key:
+        storage.delete(key)
+    cover_key = get_key_from_url(cover_image)
+    if cover_key:
+        storage.delete(cover_key)
+
+def storage_response(key: str, media_type: str, filename: str = None):
+    """Serve a stored object, from disk when this node has a copy of it."""
+    storage = _storage.get_storage()
+    try:
+        file_path = storage.local_path(key)
+        if file_path is not None:
+            return FileResponse(path=file_path, media_type=media_type, filename=filename)
+        headers = {"Content-Length": str(storage.size(key))}
+        if filename:
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return StreamingResponse(storage.get(key), media_type=media_type, headers=headers)
+    except FileNotFoundError:
+        raise _fastapi.HTTPException(status_code=404, detail="File not found")
+
+@router.get("/users_media/{key:path}")
+def get_users_media(key: str):
+    # Cover images are public; uploads only ever store audio under other names
+    try:
+        _storage.validate_key(key)
+    except ValueError:
+        raise _fastapi.HTTPException(status_code=404, detail="File not found")
+    if not key.endswith(COVER_SUFFIX):
+        raise _fastapi.HTTPException(status_code=404, detail="File not found")
+    return storage_response(key, "image/jpeg")
+
+@router.get("/api/download/{filename}", response_class=FileResponse)
+def download_file(
     filename: str,
     user: _schemas.User = _fastapi.Depends(_services.get_current_user),
     db: _orm.Session = _fastapi.Depends(_services.get_db)
 ):
-    user_dir = get_user_upload_dir(user.id)
-    file_path = os.path.join(user_dir, filename)
-    
-    if os.path.exists(file_path):
-        return FileResponse(path=file_path, media_type="application/octet-stream", filename=filename)
-    else:
+    try:
+        key = get_media_key(user.id, filename)
+    except ValueError:
         raise _fastapi.HTTPException(status_code=404, detail="File not found")
+    return storage_response(key, "application/octet-stream", filename=filename)
     
-@app.delete("/api/delete/{filename}")
-async def delete_file(
+@router.delete("/api/delete/{filename}")
+def delete_file(
     filename: str,
     user: _schemas.User = _fastapi.Depends(_services.get_current_user),
     db: _orm.Session = _fastapi.Depends(_services.get_db)
 ):
-    user_dir = get_user_upload_dir(user.id)
-    file_path = os.path.join(user_dir, filename)
-    
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        print(f"Deleted media file: {file_path}")
+    storage = _storage.get_storage()
+    try:
+        key = get_media_key(user.id, filename)
+    except ValueError:
+        raise _fastapi.HTTPException(status_code=404, detail="File not found")
+
+    if storage.exists(key):
+        storage.delete(key)
+        print(f"Deleted media file: {key}")
 
         # Remove the corresponding database entry
         media = db.query(_models.Media).filter(
@@ -206,11 +402,12 @@ async def delete_file(
         ).first()
         if media:
             # Delete the cover image file if it exists
-            cover_image_path = media.cover_image
-            if cover_image_path and os.path.exists(cover_image_path):
-                os.remove(cover_image_path)
-                print(f"Deleted cover image file: {cover_image_path}")
+            cover_key = get_key_from_url(media.cover_image)
+            if cover_key:
+                storage.delete(cover_key)
+                print(f"Deleted cover image file: {cover_key}")
 
+            _services.release_media_usage(media, db)
             db.delete(media)
             db.commit()
         return {"detail": "File and cover image successfully deleted"}
@@ -218,28 +415,98 @@ async def delete_file(
         raise _fastapi.HTTPException(status_code=404, detail="File not found")
 
 def cleanup_orphaned_entries():
-    while True:
-        db = _database.SessionLocal()
-        try:
-            media_files = db.query(_models.Media).all()
-            for media in media_files:
-                user_dir = get_user_upload_dir(media.users_id)
-                file_path = os.path.join(user_dir, media.title)
-                if not os.path.exists(file_path):
+    """Delete media rows whose file is no longer in storage, then reconcile usage.
+
+    Each user's files are listed once, rather than checking every row on its
+    own, and their rows are streamed from the database in batches. The same
+    listing fills in the size of rows stored before sizes were recorded, after
+    which every user's counters are recomputed from their rows.
+    """
+    db = _database.SessionLocal()
+    try:
+        storage = _storage.get_storage()
+        user_ids = [users_id for (users_id,) in db.query(_models.Media.users_id).distinct()]
+        for users_id in user_ids:
+            prefix = f"id_{users_id}_media/"
+            stored = dict(storage.list_objects(prefix))
+            orphaned = []
+            sizes = []
+            rows = (
+                db.query(_models.Media.id, _models.Media.title, _models.Media.size)
+                .filter(_models.Media.users_id == users_id)
+                .yield_per(CLEANUP_BATCH_SIZE)
+            )
+            for media_id, title, size in rows:
+                # Titles that are not valid file names never match a stored key
+                stored_size = stored.get(f"{prefix}{title}")
+                if stored_size is None:
+                    orphaned.append(media_id)
+                elif size is None:
+                    sizes.append({"id": media_id, "size": stored_size})
+
+            for start in range(0, len(orphaned), CLEANUP_BATCH_SIZE):
+                batch = orphaned[start:start + CLEANUP_BATCH_SIZE]
+                for media in db.query(_models.Media).filter(_models.Media.id.in_(batch)):
                     db.delete(media)
-                    db.commit()
-        except Exception as e:
-            print(f"Error during cleanup: {e}")
-        finally:
-            db.close()
-        # Run cleanup every hour (3600 seconds)
-        time.sleep(10)
+                db.commit()
+            if sizes:
+                db.execute(_sql.update(_models.Media), sizes)
+                db.commit()
+        _services.reconcile_usage(db)
+    except Exception as e:
+        print(f"Error during cleanup: {e}")
+    finally:
+        db.close()
 
-# Start the cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_orphaned_entries, daemon=True)
-cleanup_thread.start()
+def fingerprinting_available() -> bool:
+    """Fingerprinting needs NumPy and an ffmpeg binary to decode tracks with."""
+    try:
+        from app import fingerprint as _fingerprint
+    except ImportError:
+        return False
+    return shutil.which(_fingerprint.FFMPEG_BINARY) is not None
+
+# Id the next fingerprinting run continues after, so tracks that keep failing
+# for a passing reason do not hold up the rest of the queue
+_fingerprint_position = 0
+
+def fingerprint_pending_media():
+    """Ingest stage: fingerprint a batch of tracks that do not have a fingerprint yet."""
+    import subprocess
+    from app import fingerprint as _fingerprint
+
+    global _fingerprint_position
+    db = _database.SessionLocal()
+    try:
+        storage = _storage.get_storage()
+        pending = _services.get_unfingerprinted_media(db, FINGERPRINT_BATCH_SIZE, _fingerprint_position)
+        _fingerprint_position = pending[-1][0] if len(pending) == FINGERPRINT_BATCH_SIZE else 0
+        for media_id, users_id, title in pending:
+            try:
+                # None while the file is missing; cleanup_orphaned_entries drops such rows
+                file_path = storage.local_path(get_media_key(users_id, title))
+                if file_path is None:
+                    continue
+                fingerprint = _fingerprint.fingerprint_file(file_path)
+            except (subprocess.CalledProcessError, ValueError) as e:
+                # The file cannot be decoded, or is too short or silent: record it
+                # without a vector so it leaves the queue for good
+                print(f"Cannot fingerprint media {media_id}: {e}")
+                _services.save_fingerprint(media_id, users_id, None, [], db)
+                continue
+            except Exception as e:
+                # Storage, network or ffmpeg timeouts: try again on a later run
+                print(f"Error fingerprinting media {media_id}: {e}")
+                continue
+            _services.save_fingerprint(
+                media_id, users_id, _fingerprint.to_bytes(fingerprint), _fingerprint.lsh_bands(fingerprint), db
+            )
+    except Exception as e:
+        print(f"Error during fingerprinting: {e}")
+    finally:
+        db.close()
 
-@app.post("/api/media", response_model=_schemas.Media)
+@router.post("/api/media", response_model=_schemas.Media)
 async def create_media(
     media: _schemas.CreateMedia, 
     user: _schemas.User = _fastapi.Depends(_services.get_current_user),
@@ -247,7 +514,7 @@ async def create_media(
 ):
     return await _services.create_media(media=media, db=db)
 
-@app.post("/api/artist", response_model=_schemas.Artist)
+@router.post("/api/artist", response_model=_schemas.Artist)
 async def create_artist(
     artist: _schemas.CreateArtist, 
     user: _schemas.User = _fastapi.Depends(_services.get_current_user),
@@ -255,7 +522,7 @@ async def create_artist(
 ):
     return await _services.create_artist(artist=artist, db=db)
 
-@app.post("/api/album", response_model=_schemas.Album)
+@router.post("/api/album", response_model=_schemas.Album)
 async def create_album(
     album: _schemas.CreateAlbum, 
     user: _schemas.User = _fastapi.Depends(_services.get_current_user),
@@ -263,7 +530,7 @@ async def create_album(
 ):
     return await _services.create_album(album=album, db=db)
 
-@app.post("/api/users")
+@router.post("/api/users")
 async def create_user(
     user: _schemas.UserCreate, 
     db: _orm.Session = _fastapi.Depends(_services.get_db)
@@ -279,7 +546,7 @@ async def create_user(
     return await _services.create_token(user=user)
 
 
-@app.post("/api/token")
+@router.post("/api/token")
 async def generate_token(
     form_data: _security.OAuth2PasswordRequestForm = _fastapi.Depends(),
     db: "_orm.Session" = _fastapi.Depends(_services.get_db),
@@ -293,11 +560,18 @@ async def generate_token(
     
     return await _services.create_token(user=user)
 
-@app.get("/api/users/me", response_model=_schemas.User)
+@router.get("/api/users/me", response_model=_schemas.User)
 async def get_user(user: _schemas.User = _fastapi.Depends(_services.get_current_user)):
     return user
 
-@app.post("/api/posts", response_model=_schemas.Post)
+@router.get("/api/users/me/usage", response_model=_schemas.Usage)
+async def get_user_usage(
+    user: _schemas.User = _fastapi.Depends(_services.get_current_user),
+    db: _orm.Session = _fastapi.Depends(_services.get_db)
+):
+    return await _services.get_usage(user_id=user.id, db=db)
+
+@router.post("/api/posts", response_model=_schemas.Post)
 async def create_post(
     post: _schemas.PostCreate, 
     user: _schemas.User = _fastapi.Depends(_services.get_current_user), 
@@ -305,14 +579,14 @@ async def create_post(
 ):
     return await _services.create_post(user=user, db=db, post=post)
 
-@app.get("/api/posts", response_model=List[_schemas.Post])
+@router.get("/api/posts", response_model=List[_schemas.Post])
 async def get_user_posts(
     user: _schemas.User = _fastapi.Depends(_services.get_current_user), 
     db: _orm.Session = _fastapi.Depends(_services.get_db)
 ): 
     return await _services._get_user_posts(user=user, db=db)
 
-@app.get("/api/media/", response_model=list[_schemas.Media])
+@router.get("/api/media/", response_model=list[_schemas.Media])
 async def list_media(
     db: _orm.Session = _fastapi.Depends(_services.get_db),
     user: _schemas.User = _fastapi.Depends(_services.get_current_user)
@@ -324,31 +598,36 @@ async def list_media(
 
     valid_media_files = []
 
+    # Rows whose files have gone missing are pruned by cleanup_orphaned_entries
     for media in media_files:
-        user_dir = get_user_upload_dir(user.id)
-        file_path = os.path.join(user_dir, media.title)
-        if os.path.exists(file_path):
-            valid_media_files.append({
-                "id": media.id,
-                "title": media.title,
-                "artist_id": media.artist.id,
-                "artist_name": media.artist.name,
-                "album_id": media.album.id,
-                "album_name": media.album.name,
-                "time": reformat_datetime(media.time),
-                "users_id": media.users_id,
-                "length": format_length(media.length),
-                "genre": media.genre,
-                "cover_image": media.cover_image or "static_files/default_cover.png",  # Ensure the cover_image is included
-                "path": f"/users_media/id_{media.users_id}_media/{media.title}"  # Ensure the path is correct
-            })
-        else:
-            db.delete(media)
-            db.commit()
+        valid_media_files.append({
+            "id": media.id,
+            "title": media.title,
+            "artist_id": media.artist.id,
+            "artist_name": media.artist.name,
+            "album_id": media.album.id,
+            "album_name": media.album.name,
+            "time": reformat_datetime(media.time),
+            "users_id": media.users_id,
+            "length": format_length(media.length),
+            "genre": media.genre,
+            "cover_image": media.cover_image or "static_files/default_cover.png",  # Ensure the cover_image is included
+            "path": f"/users_media/id_{media.users_id}_media/{media.title}"  # Ensure the path is correct
+        })
 
     return valid_media_files
 
-@app.get("/api/media/{id}/", response_model=_schemas.Media)
+@router.get("/api/media/duplicates", response_model=list[_schemas.DuplicateCluster])
+def get_duplicate_media(
+    db: _orm.Session = _fastapi.Depends(_services.get_db),
+    user: _schemas.User = _fastapi.Depends(_services.get_current_user)
+):
+    try:
+        return _services.find_duplicate_clusters(user_id=user.id, db=db)
+    except ImportError:
+        raise _fastapi.HTTPException(status_code=503, detail="Duplicate detection is not available")
+
+@router.get("/api/media/{id}/", response_model=_schemas.Media)
 async def get_media(
     id: int, 
     db: "_orm.Session" = _fastapi.Depends(_services.get_db),
@@ -359,7 +638,7 @@ async def get_media(
         raise _fastapi.HTTPException(status_code=404, detail="Mediafile does not exist")
     return media
 
-@app.get("/api/album/{id}/", response_model=_schemas.Album)
+@router.get("/api/album/{id}/", response_model=_schemas.Album)
 async def get_album(
     id: int,
     db: "_orm.Session" = _fastapi.Depends(_services.get_db),
@@ -370,7 +649,7 @@ async def get_album(
         raise _fastapi.HTTPException(status_code=404, detail="Album does not exist")
     return album
 
-@app.get("/api/artist/{id}/", response_model=_schemas.Artist)
+@router.get("/api/artist/{id}/", response_model=_schemas.Artist)
 async def get_artist(
     id: int, 
     db: "_orm.Session" = _fastapi.Depends(_services.get_db),
@@ -381,21 +660,28 @@ async def get_artist(
         raise _fastapi.HTTPException(status_code=404, detail="Artist does not exist")
     return artist
    
-@app.delete("/api/media/{id}/")
+@router.delete("/api/media/{id}/")
 async def delete_media(
     id: int,
     db: "_orm.Session"= _fastapi.Depends(_services.get_db),
     user: _schemas.User = _fastapi.Depends(_services.get_current_user)
 ):
     media = await _services.get_media(db=db, id=id)
-    if media is None:
+    if media is None or media.users_id != user.id:
         raise _fastapi.HTTPException(status_code=404, detail="Mediafile does not exist")
-    
+
+    # The file goes with its row, otherwise it would stay stored without being counted
+    try:
+        key = get_media_key(user.id, media.title)
+    except ValueError:
+        # Titles that are not valid file names never had a stored file
+        key = None
+    await run_in_threadpool(delete_upload, key, media.cover_image)
     await _services.delete_media(media, db=db)
     return "Media was deleted successfully"
 
 
-@app.get("/api/media/search", response_model=list[_schemas.Media])
+@router.get("/api/media/search", response_model=list[_schemas.Media])
 async def search_media(
     query: str,
     db: _orm.Session = _fastapi.Depends(_services.get_db),
@@ -415,81 +701,199 @@ async def search_media(
 
     valid_media_files = []
 
+    # Rows whose files have gone missing are pruned by cleanup_orphaned_entries
     for media in media_files:
-        user_dir = get_user_upload_dir(user.id)
-        file_path = os.path.join(user_dir, media.title)
-        if os.path.exists(file_path):
-            valid_media_files.append({
-                "id": media.id,
-                "title": media.title,
-                "artist_id": media.artist.id,
-                "artist_name": media.artist.name,
-                "album_id": media.album.id,
-                "album_name": media.album.name,
-                "time": reformat_datetime(media.time),  # Ensure correct format
-                "users_id": media.users_id,
-                "length": format_length(media.length),
-                "genre": media.genre,
-                "cover_image": media.cover_image or "static_files/default_cover.png",  # Ensure the cover_image is included
-                "path": f"/users_media/id_{media.users_id}_media/{media.title}"  # Ensure the path is correct
-            })
-        else:
-            db.delete(media)
-            db.commit()
+        valid_media_files.append({
+            "id": media.id,
+            "title": media.title,
+            "artist_id": media.artist.id,
+            "artist_name": media.artist.name,
+            "album_id": media.album.id,
+            "album_name": media.album.name,
+            "time": reformat_datetime(media.time),  # Ensure correct format
+            "users_id": media.users_id,
+            "length": format_length(media.length),
+            "genre": media.genre,
+            "cover_image": media.cover_image or "static_files/default_cover.png",  # Ensure the cover_image is included
+            "path": f"/users_media/id_{media.users_id}_media/{media.title}"  # Ensure the path is correct
+        })
 
     return valid_media_files
 
-@app.get("/api/stream/{filename}")
-async def stream_file(
-    filename: str,
-    token: str,
-    request: _fastapi.Request,
+@router.get("/api/export")
+async def export_library(
+    format: str = "ndjson",
+    user: _schemas.User = _fastapi.Depends(_services.get_current_user)
+):
+    if format not in LIBRARY_FORMATS:
+        raise _fastapi.HTTPException(status_code=400, detail="Unsupported export format")
+
+    def iterlibrary():
+        # The request's session is closed before the body is sent, so the
+        # cursor gets a session that lives as long as the stream does
+        db = _database.SessionLocal()
+        try:
+            rows = _services.iter_library_rows(user_id=user.id, db=db)
+            yield from encode_library_rows(rows, format)
+        finally:
+            db.close()
+
+    headers = {"Content-Disposition": f'attachment; filename="library.{format}"'}
+    return StreamingResponse(iterlibrary(), media_type=LIBRARY_FORMATS[format], headers=headers)
+
+@router.post("/api/import")
+def import_library(
+    file: _fastapi.UploadFile = _fastapi.File(...),
+    format: str = None,
+    user: _schemas.User = _fastapi.Depends(_services.get_current_user),
     db: _orm.Session = _fastapi.Depends(_services.get_db)
 ):
+    if format is None:
+        extension = os.path.splitext(file.filename or "")[1].lower().lstrip(".")
+        format = extension if extension in LIBRARY_FORMATS else "ndjson"
+    if format not in LIBRARY_FORMATS:
+        raise _fastapi.HTTPException(status_code=400, detail="Unsupported import format")
+
+    # One listing of the user's files tells which rows have something to point at
+    prefix = f"id_{user.id}_media/"
+    stored_sizes = {
+        key[len(prefix):]: size for key, size in _storage.get_storage().list_objects(prefix)
+    }
+    rows = decode_library_rows(file.file, format)
+    return _services.import_library_rows(rows=rows, user_id=user.id, db=db, stored_sizes=stored_sizes)
+
+def parse_range(range_header: str, file_size: int):
+    """Return the inclusive (start, end) byte range requested, or None for the whole file."""
+    range_match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip()) if range_header else None
+    if not range_match or range_match.group(1) == range_match.group(2) == "":
+        return None
+
+    if range_match.group(1) == "":
+        # Suffix range: the last N bytes
+        start = max(file_size - int(range_match.group(2)), 0)
+        end = file_size - 1
+    else:
+        start = int(range_match.group(1))
+        end = min(int(range_match.group(2)), file_size - 1) if range_match.group(2) else file_size - 1
+
+    if start >= file_size or start > end:
+        raise _fastapi.HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, end
+
+async def run_storage(method, *args):
+    """Call a storage method, in the threadpool unless the driver only opens local files.
+
+    Remote drivers and the read-through cache can download a whole object
+    before returning, which must not hold up the event loop.
+    """
+    if isinstance(_storage.get_storage(), _storage.LocalStorage):
+        return method(*args)
+    return await run_in_threadpool(method, *args)
+
+@router.get("/api/media/{id}/stream-url")
+def get_stream_url(
+    id: int,
+    db: _orm.Session = _fastapi.Depends(_services.get_db),
+    user: _schemas.User = _fastapi.Depends(_services.get_current_user)
+):
+    media = db.query(_models.Media).filter(
+        _models.Media.id == id,
+        _models.Media.users_id == user.id
+    ).first()
+    if media is None:
+        raise _fastapi.HTTPException(status_code=404, detail="Mediafile does not exist")
+
     try:
-        user = await _services.get_current_user(token=token, db=db)
-        user_dir = get_user_upload_dir(user.id)
-        file_path = os.path.join(user_dir, filename)
+        key = get_media_key(user.id, media.title)
+        size = media.size if media.size is not None else _storage.get_storage().size(key)
+    except (ValueError, FileNotFoundError):
+        raise _fastapi.HTTPException(status_code=404, detail="File not found")
+
+    params = _services.create_stream_signature(key, size)
+    query = "&".join(f"{name}={value}" for name, value in params.items())
+    return {"url": f"/api/stream/{quote(key)}?{query}", "expires": params["expires"]}
 
-        if not os.path.exists(file_path):
+@router.get("/api/stream/{key:path}")
+async def stream_file(
+    key: str,
+    size: int,
+    expires: int,
+    signature: str,
+    request: _fastapi.Request
+):
+    # The signature covers the key and its size, so nothing here needs the database
+    if not _services.verify_stream_signature(key, size, expires, signature):
+        raise _fastapi.HTTPException(status_code=403, detail="Invalid or expired stream URL")
+
+    content_type = mimetypes.guess_type(key)[0] or "audio/mpeg"
+
+    if STREAM_OFFLOAD == "x-accel-redirect":
+        # The front proxy serves the file and handles Range itself
+        return _fastapi.Response(headers={
+            "X-Accel-Redirect": f"{STREAM_ACCEL_PREFIX}{quote(key)}",
+            "Content-Type": content_type,
+        })
+    if STREAM_OFFLOAD == "x-sendfile":
+        try:
+            file_path = await run_storage(_storage.get_storage().local_path, key)
+        except FileNotFoundError:
+            file_path = None
+        if file_path is None:
             raise _fastapi.HTTPException(status_code=404, detail="File not found")
+        return _fastapi.Response(headers={
+            "X-Sendfile": os.path.abspath(file_path),
+            "Content-Type": content_type,
+        })
+
+    byte_range = parse_range(request.headers.get("Range"), size)
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Type": content_type,
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
 
-        file_size = os.path.getsize(file_path)
-        range_header = request.headers.get('Range', None)
-        start = 0
-        end = file_size - 1
+    try:
+        body = await run_storage(_storage.get_storage().get_range, key, start, end, STREAM_CHUNK_SIZE)
+    except FileNotFoundError:
+        raise _fastapi.HTTPException(status_code=404, detail="File not found")
+    return StreamingResponse(body, status_code=206 if byte_range else 200, headers=headers)
 
-        if range_header:
-            range_match = re.match(r'bytes=(\d+)-(\d+)?', range_header)
-            if range_match:
-                start = int(range_match.group(1))
-                if range_match.group(2):
-                    end = int(range_match.group(2))
-                else:
-                    end = file_size - 1
-
-        chunk_size = end - start + 1
-
-        def iterfile():
-            nonlocal chunk_size  # Ensure chunk_size is accessible in this scope
-            with open(file_path, mode="rb") as file:
-                file.seek(start)
-                while chunk_size > 0:
-                    chunk = file.read(min(4096, chunk_size))
-                    if not chunk:
-                        break
-                    yield chunk
-                    chunk_size -= len(chunk)
-
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(chunk_size),
-            "Content-Type": "audio/mpeg",
-        }
-
-        return StreamingResponse(iterfile(), status_code=206, headers=headers)
 
-    except Exception as e:
-        raise _fastapi.HTTPException(status_code=500, detail=str(e))
-    
+@contextlib.asynccontextmanager
+async def lifespan(app: _fastapi.FastAPI):
+    _database.init_db()
+    background = BackgroundWorker()
+    if background.acquire():
+        background.schedule(cleanup_orphaned_entries, CLEANUP_INTERVAL)
+        if fingerprinting_available():
+            background.schedule(fingerprint_pending_media, FINGERPRINT_INTERVAL)
+        else:
+            print("NumPy or ffmpeg not found, tracks will not be fingerprinted")
+    try:
+        yield
+    finally:
+        background.stop()
+
+def create_app() -> _fastapi.FastAPI:
+    """Build the application; nothing touches the disk or the database until startup."""
+    # Sharing the router's routes avoids include_router rebuilding every route
+    app = _fastapi.FastAPI(lifespan=lifespan, routes=router.routes)
+    app.add_middleware(UploadQuotaMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.mount("/static_files", StaticFiles(directory="static_files", check_dir=False), name="static_files")
+    return app
+
+app = create_app()
@@ -0,0 +1,36 @@
+import os
+
+from app.storage.base import Storage, validate_key
+from app.storage.local import LocalStorage
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "users_media")
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", 2 * 1024 ** 3))
+
+_storage = None
+
+def create_storage() -> Storage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(MEDIA_ROOT)
+    if STORAGE_BACKEND == "s3":
+        from app.storage.cache import ReadThroughCache
+        from app.storage.s3 import S3Storage
+
+        backend = S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region_name=os.getenv("S3_REGION"),
+            aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+        )
+        return ReadThroughCache(backend, MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+def get_storage() -> Storage:
+    """Return the process-wide storage driver, creating it on first use."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
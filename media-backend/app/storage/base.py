@@ -0,0 +1,53 @@
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+# Default size of the chunks yielded by get and get_range
+CHUNK_SIZE = 64 * 1024
+
+
+class Storage:
+    """Interface every media storage driver implements.
+
+    Keys are relative, slash-separated paths such as "id_1_media/song.mp3".
+    Reading a key that does not exist raises FileNotFoundError.
+    """
+
+    def put(self, key: str, fileobj: BinaryIO) -> int:
+        """Store the contents of fileobj under key and return the number of bytes written."""
+        raise NotImplementedError
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the bytes from start to end (inclusive, None for the end of the object)."""
+        raise NotImplementedError
+
+    def get(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return self.get_range(key, 0, None, chunk_size)
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def version(self, key: str) -> str:
+        """Return a token that changes whenever the object under key is replaced."""
+        raise NotImplementedError
+
+    def list_objects(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        """Yield (key, size) for every object stored under the directory prefix."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Remove key, doing nothing if it does not exist."""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Return a path on this node's disk holding the object, if the driver has one."""
+        return None
+
+
+def validate_key(key: str) -> str:
+    """Reject keys that are empty, absolute or step outside the storage root."""
+    parts = key.split("/")
+    if not key or key.startswith("/") or "\\" in key or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
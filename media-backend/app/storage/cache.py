@@ -0,0 +1,115 @@
+import glob
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from app.storage.base import CHUNK_SIZE, Storage, validate_key
+from app.storage.local import _iter_file
+
+
+class ReadThroughCache(Storage):
+    """Keeps local copies of objects read from a remote backend.
+
+    Writes and deletes go straight to the backend, which stays the source of
+    truth; any number of replicas can each run their own cache in front of it.
+    Local copies are named after the backend's version of the object and every
+    read checks that version first, so a replica never serves a file another
+    replica has deleted or replaced. The cache directory is trimmed to
+    max_bytes, dropping the least recently read files first.
+    """
+
+    def __init__(self, backend: Storage, directory: str, max_bytes: int):
+        self.backend = backend
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, *validate_key(key).split("/"))
+
+    def _fetch(self, key: str) -> str:
+        # Raises FileNotFoundError once the object is gone from the backend
+        version = hashlib.sha1(self.backend.version(key).encode()).hexdigest()[:16]
+        path = f"{self._path(key)}~{version}"
+        if os.path.isfile(path):
+            # Bump the access time used for eviction
+            os.utime(path)
+            return path
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".fetch-")
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                for chunk in self.backend.get(key):
+                    buffer.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._invalidate(key, keep=path)
+        self._trim(keep=path)
+        return path
+
+    def _trim(self, keep: str):
+        files = []
+        total = os.path.getsize(keep)
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(directory, name)
+                # Skip downloads in progress and the file that is about to be served
+                if name.startswith(".") or path == keep:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _invalidate(self, key: str, keep: Optional[str] = None):
+        """Remove the local copies of key, except keep."""
+        for path in glob.glob(f"{glob.escape(self._path(key))}~*"):
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def put(self, key: str, fileobj: BinaryIO) -> int:
+        self._invalidate(key)
+        return self.backend.put(key, fileobj)
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        file = open(self._fetch(key), "rb")
+        return _iter_file(file, start, end, chunk_size)
+
+    def size(self, key: str) -> int:
+        return self.backend.size(key)
+
+    def version(self, key: str) -> str:
+        return self.backend.version(key)
+
+    def list_objects(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        return self.backend.list_objects(prefix)
+
+    def exists(self, key: str) -> bool:
+        return self.backend.exists(key)
+
+    def delete(self, key: str) -> None:
+        self._invalidate(key)
+        self.backend.delete(key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._fetch(key)
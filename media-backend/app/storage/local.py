@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from app.storage.base import CHUNK_SIZE, Storage, validate_key
+
+
+# Directory under the root that uploads are written to before they are renamed into place
+INCOMING_DIR = ".incoming"
+
+
+class LocalStorage(Storage):
+    """Stores media as plain files under a root directory on this node."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        parts = validate_key(key).split("/")
+        if parts[0] == INCOMING_DIR:
+            raise ValueError(f"Invalid storage key: {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def put(self, key: str, fileobj: BinaryIO) -> int:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write outside the key namespace and rename, so readers and listings
+        # never see a partial file
+        incoming = os.path.join(self.root, INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=incoming, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                shutil.copyfileobj(fileobj, buffer, CHUNK_SIZE)
+                written = buffer.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return written
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        # Open eagerly so a missing key fails before the response starts
+        file = open(self._path(key), "rb")
+        return _iter_file(file, start, end, chunk_size)
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self._path(key))
+
+    def version(self, key: str) -> str:
+        stat = os.stat(self._path(key))
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def list_objects(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        prefix = validate_key(prefix.rstrip("/"))
+        for directory, _, names in os.walk(self._path(prefix)):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for name in names:
+                try:
+                    size = os.path.getsize(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                yield f"{relative}/{name}", size
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+
+def _iter_file(file: BinaryIO, start: int, end: Optional[int], chunk_size: int) -> Iterator[bytes]:
+    with file:
+        file.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            yield chunk
+            if remaining is not None:
+                remaining -= len(chunk)
@@ -0,0 +1,105 @@
+import os
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from app.storage.base import CHUNK_SIZE, Storage, validate_key
+
+
+class S3Storage(Storage):
+    """Stores media in a bucket of an S3-compatible service (AWS S3, MinIO, ...)."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, **client_options):
+        # boto3 is only needed when this driver is configured
+        try:
+            import boto3
+            import botocore.exceptions
+        except ImportError as error:
+            raise RuntimeError("The s3 storage backend requires boto3 (poetry install --extras s3)") from error
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, **client_options)
+        self._client_error = botocore.exceptions.ClientError
+
+    def _object_key(self, key: str) -> str:
+        validate_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, key: str, fileobj: BinaryIO) -> int:
+        length = None
+        if fileobj.seekable():
+            start = fileobj.tell()
+            length = fileobj.seek(0, os.SEEK_END) - start
+            fileobj.seek(start)
+        # upload_fileobj switches to a multipart upload for large files, and
+        # closes the file it is given, which stays the caller's to close
+        self.client.upload_fileobj(_KeepOpen(fileobj), self.bucket, self._object_key(key))
+        return length if length is not None else self.size(key)
+
+    def get_range(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        options = {}
+        # S3 rejects any Range on an empty object, so whole reads go without one
+        if start or end is not None:
+            options["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), **options)
+        except self._client_error as error:
+            if self._is_missing(error):
+                raise FileNotFoundError(key) from error
+            raise
+        return _iter_body(response["Body"], chunk_size)
+
+    def _head(self, key: str) -> dict:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client_error as error:
+            if self._is_missing(error):
+                raise FileNotFoundError(key) from error
+            raise
+
+    def size(self, key: str) -> int:
+        return self._head(key)["ContentLength"]
+
+    def version(self, key: str) -> str:
+        return self._head(key)["ETag"]
+
+    def list_objects(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        # One listing request returns up to 1000 keys, against a HEAD request per key
+        object_prefix = self._object_key(prefix.rstrip("/")) + "/"
+        skip = len(self.prefix) + 1 if self.prefix else 0
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=object_prefix)
+        for page in pages:
+            for item in page.get("Contents", []):
+                yield item["Key"][skip:], item["Size"]
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.size(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+class _KeepOpen:
+    """Forwards everything to a file object except close()."""
+
+    def __init__(self, fileobj: BinaryIO):
+        self._fileobj = fileobj
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+    def close(self):
+        pass
+
+
+def _iter_body(body, chunk_size: int) -> Iterator[bytes]:
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
@@ -0,0 +1,103 @@
+"""Measure duplicate detection on a large library.
+
+Fills a scratch SQLite database with one user's library of random
+fingerprints, then fingerprints the last --duplicates tracks as near copies
+of earlier ones through services.save_fingerprint, the path the ingest stage
+uses. Reports the time that takes per track and the time
+find_duplicate_clusters, the /api/media/duplicates query, takes to return
+the clusters. Exits with status 1 when the query is slower than --target.
+
+    python benchmarks/duplicates.py [--tracks 100000] [--duplicates 500] [--runs 5] [--target 1.0] [--output FILE]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--duplicates", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target", type=float, default=1.0, help="seconds allowed for the clusters query")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    # The app reads DATABASE_URL at import time
+    scratch = tempfile.mkdtemp(prefix="media-backend-duplicates-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch, 'duplicates.db')}"
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+    import sqlalchemy as _sql
+    from app import fingerprint as _fingerprint
+    from app.database import database as _database, models as _models, services as _services
+
+    _database.init_db()
+    db = _database.SessionLocal()
+    user = _models.User(email="owner@example.com", hashed_password="")
+    db.add_all([user, _models.Artist(name="Artist"), _models.Album(name="Album")])
+    db.commit()
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((args.tracks, _fingerprint.DIMENSIONS)).astype(np.float32)
+    for index in range(args.duplicates):
+        vectors[args.tracks - 1 - index] = vectors[index] + 0.01 * rng.standard_normal(_fingerprint.DIMENSIONS)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    db.execute(_sql.insert(_models.Media), [
+        {"id": index + 1, "title": f"track{index}.mp3", "artist_id": 1, "album_id": 1,
+         "users_id": user.id, "length": 200, "size": 1000}
+        for index in range(args.tracks)
+    ])
+    # Everything but the copies is already fingerprinted, written in bulk
+    existing = args.tracks - args.duplicates
+    db.execute(_sql.insert(_models.Fingerprint), [
+        {"media_id": index + 1, "users_id": user.id, "vector": _fingerprint.to_bytes(vectors[index])}
+        for index in range(existing)
+    ])
+    db.execute(_sql.insert(_models.FingerprintBand), [
+        {"media_id": index + 1, "band": band, "hash": hash, "users_id": user.id}
+        for index in range(existing)
+        for band, hash in enumerate(_fingerprint.lsh_bands(vectors[index]))
+    ])
+    db.commit()
+
+    ingest = []
+    for index in range(existing, args.tracks):
+        started = time.perf_counter()
+        _services.save_fingerprint(
+            index + 1, user.id, _fingerprint.to_bytes(vectors[index]), _fingerprint.lsh_bands(vectors[index]), db
+        )
+        ingest.append(time.perf_counter() - started)
+
+    queries = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        clusters = _services.find_duplicate_clusters(user_id=user.id, db=db)
+        queries.append(time.perf_counter() - started)
+    db.close()
+
+    report = [
+        f"python {sys.version.split()[0]}, sqlite, {args.tracks} tracks, {args.duplicates} copies, {args.runs} runs",
+        f"save_fingerprint per copy: median {statistics.median(ingest) * 1000:.1f} ms "
+        f"(max {max(ingest) * 1000:.1f} ms)",
+        f"find_duplicate_clusters: median {statistics.median(queries) * 1000:.1f} ms "
+        f"(max {max(queries) * 1000:.1f} ms), {len(clusters)} clusters",
+        f"target: {args.target * 1000:.0f} ms",
+    ]
+    text = "\n".join(report)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    if max(queries) > args.target:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure how long a worker takes to import the application.
+
+Runs `python -X importtime -c "import app.main"` in fresh interpreters and
+reports the median total import time, the number of modules imported, the
+peak RSS of the importing process and the top-level packages that contribute
+most to the import. The module count does not depend on machine load, so it
+is the number to compare between commits.
+
+    python benchmarks/importtime.py [--runs 5] [--top 15] [--output FILE]
+"""
+import argparse
+import collections
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Peak RSS is read in the same interpreter, right after the import finishes
+_IMPORT_SNIPPET = "import app.main, resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def run_once():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _IMPORT_SNIPPET],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    total_us = next(cumulative for name, _, cumulative in modules if name == "app.main")
+    max_rss_kb = int(result.stdout.strip().splitlines()[-1])
+    return total_us, max_rss_kb, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    totals, rss, module_counts, per_package = [], [], [], collections.defaultdict(list)
+    for _ in range(args.runs):
+        total_us, max_rss_kb, modules = run_once()
+        totals.append(total_us)
+        rss.append(max_rss_kb)
+        module_counts.append(len(modules))
+        package_totals = collections.Counter()
+        for name, self_us, _ in modules:
+            package_totals[name.split(".")[0]] += self_us
+        for package, self_us in package_totals.items():
+            per_package[package].append(self_us)
+
+    report = [
+        f"python {sys.version.split()[0]}, {args.runs} runs",
+        f"import app.main: median {statistics.median(totals) / 1000:.1f} ms "
+        f"(min {min(totals) / 1000:.1f} ms, max {max(totals) / 1000:.1f} ms)",
+        f"modules imported: {statistics.median(module_counts):.0f}",
+        f"peak RSS after import: median {statistics.median(rss) / 1024:.1f} MiB",
+        "",
+        f"top {args.top} packages by self time (median ms):",
+    ]
+    ranked = sorted(per_package.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, values in ranked[:args.top]:
+        report.append(f"  {statistics.median(values) / 1000:8.1f}  {package}")
+
+    text = "\n".join(report)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import tempfile
+
+# The app reads its configuration at import time, so point it at a scratch
+# SQLite database and keep the background sweeps out of the tests
+_TEST_DIR = tempfile.mkdtemp(prefix="media-backend-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}")
+os.environ.setdefault("BACKGROUND_TASKS", "off")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import storage as _storage
+from app.database import database as _database, models as _models, services as _services
+from app.main import app
+
+
+@pytest.fixture
+def db():
+    _database.Base.metadata.drop_all(bind=_database.engine)
+    _database.init_db()
+    session = _database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    local_storage = _storage.LocalStorage(str(tmp_path / "users_media"))
+    monkeypatch.setattr(_storage, "_storage", local_storage)
+    return local_storage
+
+
+@pytest.fixture
+def client(db, storage):
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a user directly and return it with the headers of a valid token."""
+    def make_user(email: str, storage_quota: int = None):
+        user = _models.User(email=email, hashed_password="", storage_quota=storage_quota)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        token = asyncio.run(_services.create_token(user=user))["access_token"]
+        return user, {"Authorization": f"Bearer {token}"}
+    return make_user
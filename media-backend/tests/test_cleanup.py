@@ -0,0 +1,48 @@
+import datetime as _dt
+import io
+
+from app.database import models as _models
+from app.main import cleanup_orphaned_entries
+
+
+def add_media(db, user, title, size):
+    artist = db.query(_models.Artist).filter_by(name="Artist").first() or _models.Artist(name="Artist")
+    album = db.query(_models.Album).filter_by(name="Album").first() or _models.Album(name="Album")
+    media = _models.Media(
+        title=title, artist=artist, album=album, users_id=user.id,
+        time=_dt.datetime(2024, 1, 1), length=1, size=size,
+    )
+    db.add(media)
+    user.storage_used += size
+    user.track_count += 1
+    db.commit()
+    return media
+
+
+def test_cleanup_removes_rows_without_files(db, storage, make_user):
+    first, _ = make_user("first@example.com")
+    second, _ = make_user("second@example.com")
+    for user in (first, second):
+        for name in ("kept.mp3", "lost.mp3", "bad/name.mp3"):
+            add_media(db, user, name, 10)
+        storage.put(f"id_{user.id}_media/kept.mp3", io.BytesIO(b"x" * 10))
+
+    cleanup_orphaned_entries()
+
+    db.expire_all()
+    for user in (first, second):
+        titles = [title for (title,) in db.query(_models.Media.title).filter_by(users_id=user.id)]
+        assert titles == ["kept.mp3"]
+        assert (user.storage_used, user.track_count) == (10, 1)
+
+
+def test_cleanup_keeps_dot_files(client, db, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    client.post("/api/upload/", files={"files": (".song.mp3", b"x" * 100)}, headers=headers)
+
+    cleanup_orphaned_entries()
+
+    db.expire_all()
+    assert db.query(_models.Media.title).filter_by(users_id=user.id).scalar() == ".song.mp3"
+    assert storage.exists(f"id_{user.id}_media/.song.mp3")
+    assert (user.storage_used, user.track_count) == (100, 1)
@@ -0,0 +1,110 @@
+import io
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app import fingerprint as _fingerprint, main as _main
+from app.database import models as _models, services as _services
+
+
+def unit(vector):
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def with_similarity(vector, similarity, rng):
+    """Return a unit vector whose cosine similarity to vector is exactly similarity."""
+    noise = rng.standard_normal(vector.shape)
+    noise = unit(noise - noise.dot(vector) * vector)
+    return unit(similarity * vector + np.sqrt(1 - similarity ** 2) * noise)
+
+
+def add_track(db, user, title, size, vector):
+    artist = db.query(_models.Artist).filter_by(name="Artist").first() or _models.Artist(name="Artist")
+    album = db.query(_models.Album).filter_by(name="Album").first() or _models.Album(name="Album")
+    media = _models.Media(title=title, artist=artist, album=album, users_id=user.id, length=200, size=size)
+    db.add(media)
+    db.commit()
+    _services.save_fingerprint(media.id, user.id, _fingerprint.to_bytes(vector), _fingerprint.lsh_bands(vector), db)
+    return media.id
+
+
+def test_clusters_tracks_with_unknown_size(client, db, make_user):
+    user, headers = make_user("owner@example.com")
+    rng = np.random.default_rng(1)
+    original = unit(rng.standard_normal(_fingerprint.DIMENSIONS))
+    add_track(db, user, "original.mp3", 5000, original)
+    add_track(db, user, "copy.mp3", None, with_similarity(original, 0.999, rng))
+    add_track(db, user, "other.mp3", 3000, unit(rng.standard_normal(_fingerprint.DIMENSIONS)))
+
+    clusters = _services.find_duplicate_clusters(user_id=user.id, db=db)
+    assert len(clusters) == 1
+    assert [track.title for track in clusters[0].tracks] == ["original.mp3", "copy.mp3"]
+    assert [track.size for track in clusters[0].tracks] == [5000, None]
+    assert clusters[0].reclaimable_bytes == 0
+
+    response = client.get("/api/media/duplicates", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+def test_pairs_are_stored_at_ingest(client, db, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    rng = np.random.default_rng(3)
+    original = unit(rng.standard_normal(_fingerprint.DIMENSIONS))
+    first = add_track(db, user, "original.mp3", 5000, original)
+    add_track(db, user, "unrelated.mp3", 4000, unit(rng.standard_normal(_fingerprint.DIMENSIONS)))
+    copy = add_track(db, user, "copy.mp3", 5000, with_similarity(original, 0.99, rng))
+
+    pairs = db.query(_models.DuplicatePair.media_id, _models.DuplicatePair.duplicate_id).all()
+    assert pairs == [(first, copy)]
+    assert [cluster.reclaimable_bytes for cluster in _services.find_duplicate_clusters(user.id, db)] == [5000]
+
+    storage.put(f"id_{user.id}_media/copy.mp3", io.BytesIO(b"x"))
+    assert client.delete(f"/api/media/{copy}/", headers=headers).status_code == 200
+    db.expire_all()
+    assert db.query(_models.DuplicatePair).count() == 0
+    assert client.get("/api/media/duplicates", headers=headers).json() == []
+
+
+@pytest.mark.parametrize("similarity", [0.9, 0.95, 0.98])
+def test_candidate_probability_matches_lsh(similarity):
+    rng = np.random.default_rng(2)
+    trials = 400
+    shared = 0
+    for _ in range(trials):
+        vector = unit(rng.standard_normal(_fingerprint.DIMENSIONS))
+        first = _fingerprint.lsh_bands(vector)
+        second = _fingerprint.lsh_bands(with_similarity(vector, similarity, rng))
+        shared += any(a == b for a, b in zip(first, second))
+    assert abs(shared / trials - _fingerprint.candidate_probability(similarity)) < 0.1
+
+
+def test_threshold_recall():
+    assert _fingerprint.candidate_probability(_fingerprint.SIMILARITY_THRESHOLD) > 0.8
+    assert _fingerprint.candidate_probability(0.98) > 0.99
+
+
+@pytest.mark.parametrize("error, recorded", [
+    (subprocess.CalledProcessError(1, "ffmpeg"), True),
+    (ValueError("Track is too short to fingerprint"), True),
+    (subprocess.TimeoutExpired("ffmpeg", 120), False),
+    (OSError("connection reset"), False),
+])
+def test_only_decode_failures_leave_the_queue(db, storage, make_user, monkeypatch, error, recorded):
+    user, _ = make_user("owner@example.com")
+    media = _models.Media(title="song.mp3", users_id=user.id, length=1)
+    db.add(media)
+    db.commit()
+    storage.put(f"id_{user.id}_media/song.mp3", io.BytesIO(b"data"))
+
+    def fail(path):
+        raise error
+    monkeypatch.setattr(_fingerprint, "fingerprint_file", fail)
+    _main.fingerprint_pending_media()
+
+    fingerprint = db.query(_models.Fingerprint).filter_by(media_id=media.id).first()
+    assert (fingerprint is not None) == recorded
+    if recorded:
+        assert fingerprint.vector is None
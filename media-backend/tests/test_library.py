@@ -0,0 +1,96 @@
+import io
+import json
+
+from app.database import models as _models
+from app.main import cleanup_orphaned_entries
+
+
+def ndjson(rows):
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+def library_rows(count):
+    return [
+        {
+            "title": f"track{number}.mp3",
+            "artist_name": f"Artist {number % 3}",
+            "album_name": "Album",
+            "time": "2024-01-01T00:00:00Z",
+            "length": number,
+            "genre": "Rock",
+            "cover_image": None,
+        }
+        for number in range(count)
+    ]
+
+
+def store_files(storage, user, rows):
+    for row in rows:
+        storage.put(f"id_{user.id}_media/{row['title']}", io.BytesIO(b"x" * 10))
+
+
+def test_export_import_round_trip(client, storage, make_user):
+    user, owner = make_user("owner@example.com")
+    store_files(storage, user, library_rows(25))
+    response = client.post("/api/import", files={"file": ("library.ndjson", ndjson(library_rows(25)))}, headers=owner)
+    assert response.json() == {"imported": 25, "skipped": 0, "missing": 0, "missing_titles": []}
+
+    for format in ("ndjson", "csv"):
+        exported = client.get(f"/api/export?format={format}", headers=owner)
+        assert exported.status_code == 200
+
+        other_user, other = make_user(f"{format}@example.com")
+        store_files(storage, other_user, library_rows(25))
+        response = client.post("/api/import", files={"file": (f"library.{format}", exported.content)}, headers=other)
+        assert response.json()["imported"] == 25
+        assert client.get(f"/api/export?format={format}", headers=other).content == exported.content
+
+
+def test_import_skips_existing_titles(client, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    store_files(storage, user, library_rows(5))
+    client.post("/api/import", files={"file": ("library.ndjson", ndjson(library_rows(3)))}, headers=headers)
+    response = client.post("/api/import", files={"file": ("library.ndjson", ndjson(library_rows(5)))}, headers=headers)
+    assert response.json() == {"imported": 2, "skipped": 3, "missing": 0, "missing_titles": []}
+    usage = client.get("/api/users/me/usage", headers=headers).json()
+    assert (usage["storage_used"], usage["track_count"]) == (50, 5)
+
+
+def test_imported_rows_survive_the_sweep(client, db, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    rows = library_rows(4)
+    store_files(storage, user, rows[:2])
+    response = client.post("/api/import", files={"file": ("library.ndjson", ndjson(rows))}, headers=headers)
+    assert response.json() == {
+        "imported": 2, "skipped": 0, "missing": 2, "missing_titles": ["track2.mp3", "track3.mp3"],
+    }
+
+    cleanup_orphaned_entries()
+
+    db.expire_all()
+    titles = [title for (title,) in db.query(_models.Media.title).filter_by(users_id=user.id).order_by(_models.Media.id)]
+    assert titles == ["track0.mp3", "track1.mp3"]
+    assert (user.storage_used, user.track_count) == (20, 2)
+
+
+def test_invalid_record_imports_nothing(client, storage, make_user, db):
+    user, headers = make_user("owner@example.com")
+    rows = library_rows(2500)
+    store_files(storage, user, rows)
+    rows[2200] = {"title": "broken.mp3", "length": "not a number"}
+    response = client.post("/api/import", files={"file": ("library.ndjson", ndjson(rows))}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid library record 2201"
+    assert db.query(_models.Media).count() == 0
+    assert client.get("/api/users/me/usage", headers=headers).json()["track_count"] == 0
+
+
+def test_invalid_json_and_encoding(client, make_user):
+    _, headers = make_user("owner@example.com")
+    response = client.post("/api/import", files={"file": ("library.ndjson", b'{"title": "a"}\nnot json\n')}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid JSON on line 2"
+
+    for name in ("library.ndjson", "library.csv"):
+        response = client.post("/api/import", files={"file": (name, b"title\n\xff\xfe\n")}, headers=headers)
+        assert response.status_code == 400
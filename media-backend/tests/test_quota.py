@@ -0,0 +1,213 @@
+import asyncio
+import io
+
+import fastapi
+import pytest
+import sqlalchemy as _sql
+
+from app import main as _main
+from app.database import database as _database, models as _models, schemas as _schemas, services as _services
+
+
+def usage(client, headers):
+    response = client.get("/api/users/me/usage", headers=headers).json()
+    return response["storage_used"], response["track_count"]
+
+
+def upload(client, headers, name="bad.mp3", data=b"\0" * 4000):
+    return client.post("/api/upload/", files={"files": (name, data)}, headers=headers)
+
+
+def test_claim_storage(db, make_user):
+    user, _ = make_user("owner@example.com", storage_quota=1000)
+    assert _services.claim_storage(user.id, 600, db)
+    assert not _services.claim_storage(user.id, 600, db)
+    assert _services.claim_storage(user.id, 400, db)
+    # Tracks without a stored file always fit
+    assert _services.claim_storage(user.id, 0, db)
+    db.commit()
+    assert _services.read_usage(user.id, db) == _schemas.Usage(storage_used=1000, storage_quota=1000, track_count=3)
+
+
+def test_quota_is_checked_when_the_row_is_created(client, storage, make_user, monkeypatch):
+    user, headers = make_user("owner@example.com", storage_quota=5000)
+
+    # Another upload from the same user fills the quota while this one is stored
+    put = storage.put
+    def put_and_fill_quota(key, fileobj):
+        written = put(key, fileobj)
+        session = _database.SessionLocal()
+        session.execute(
+            _sql.update(_models.User).where(_models.User.id == user.id).values(storage_used=3000)
+        )
+        session.commit()
+        session.close()
+        return written
+    monkeypatch.setattr(storage, "put", put_and_fill_quota)
+
+    assert upload(client, headers).status_code == 413
+    assert not storage.exists(f"id_{user.id}_media/bad.mp3")
+    assert usage(client, headers) == (3000, 0)
+
+
+def test_reconcile_keeps_concurrent_uploads(db, make_user):
+    user, _ = make_user("owner@example.com")
+    db.add(_models.Media(title="counted.mp3", users_id=user.id, length=1, size=300))
+    db.commit()
+    _services.reconcile_usage(db)
+
+    assert _services.claim_storage(user.id, 500, db)
+    db.add(_models.Media(title="new.mp3", users_id=user.id, length=1, size=500))
+    db.commit()
+    _services.reconcile_usage(db)
+    assert _services.read_usage(user.id, db).storage_used == 800
+
+
+def test_upload_counts_usage_and_skips_existing(client, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    response = upload(client, headers)
+    assert response.status_code == 200
+    assert [media["title"] for media in response.json()["uploaded_files"]] == ["bad.mp3"]
+    assert storage.size(f"id_{user.id}_media/bad.mp3") == 4000
+    assert usage(client, headers) == (4000, 1)
+
+    assert upload(client, headers).json()["uploaded_files"] == []
+    assert usage(client, headers) == (4000, 1)
+
+
+def test_failed_upload_is_rolled_back(client, storage, make_user, monkeypatch):
+    user, headers = make_user("owner@example.com")
+
+    async def fail(**kwargs):
+        raise RuntimeError("database went away")
+    monkeypatch.setattr(_services, "create_media", fail)
+
+    with pytest.raises(RuntimeError):
+        upload(client, headers)
+    assert not storage.exists(f"id_{user.id}_media/bad.mp3")
+    assert usage(client, headers) == (0, 0)
+
+
+def not_reached(*args, **kwargs):
+    raise AssertionError("the body was parsed")
+
+
+def test_content_length_is_checked_before_parsing(client, make_user, monkeypatch):
+    _, headers = make_user("owner@example.com", storage_quota=1000)
+    monkeypatch.setattr(_main, "save_upload", not_reached)
+
+    response = upload(client, headers)
+    assert response.status_code == 413
+    assert usage(client, headers) == (0, 0)
+
+    response = client.post("/api/upload/", content=b"", headers={**headers, "Content-Length": "12abc"})
+    assert response.status_code == 400
+
+
+def test_chunked_upload_is_refused(client, make_user, monkeypatch):
+    _, headers = make_user("owner@example.com", storage_quota=100_000)
+    monkeypatch.setattr(_main, "save_upload", not_reached)
+
+    def body():
+        yield b'--boundary\r\nContent-Disposition: form-data; name="files"; filename="big.mp3"\r\n\r\n'
+        for _ in range(1000):
+            yield b"\0" * 1024
+        yield b"\r\n--boundary--\r\n"
+
+    response = client.post(
+        "/api/upload/",
+        content=body(),
+        headers={**headers, "Content-Type": "multipart/form-data; boundary=boundary"},
+    )
+    assert response.status_code == 413
+    assert usage(client, headers) == (0, 0)
+
+
+def test_middleware_stops_reading_over_quota(db, make_user):
+    user, headers = make_user("owner@example.com", storage_quota=10 * 1024)
+    chunks_sent = 0
+
+    async def receive():
+        nonlocal chunks_sent
+        chunks_sent += 1
+        return {"type": "http.request", "body": b"\0" * 1024, "more_body": chunks_sent < 1000}
+
+    async def app(scope, receive, send):
+        while (await receive())["more_body"]:
+            pass
+
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/upload/",
+        "headers": [(b"authorization", headers["Authorization"].encode())],
+    }
+    with pytest.raises(fastapi.HTTPException) as error:
+        asyncio.run(_main.UploadQuotaMiddleware(app)(scope, receive, None))
+    assert error.value.status_code == 413
+    assert chunks_sent == 11
+
+
+def test_upload_requires_token_before_parsing(client, monkeypatch):
+    monkeypatch.setattr(_main, "save_upload", not_reached)
+    assert upload(client, {}).status_code == 401
+    assert upload(client, {"Authorization": "Bearer not-a-token"}).status_code == 401
+
+
+def test_upload_over_quota(client, storage, make_user):
+    user, headers = make_user("owner@example.com", storage_quota=5000)
+    assert upload(client, headers, "first.mp3").status_code == 200
+    assert upload(client, headers, "second.mp3").status_code == 413
+    assert not storage.exists(f"id_{user.id}_media/second.mp3")
+    assert usage(client, headers) == (4000, 1)
+
+
+def test_delete_paths_release_usage(client, db, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    upload(client, headers, "first.mp3")
+    upload(client, headers, "second.mp3")
+    assert usage(client, headers) == (8000, 2)
+
+    assert client.delete("/api/delete/first.mp3", headers=headers).status_code == 200
+    assert not storage.exists(f"id_{user.id}_media/first.mp3")
+    assert usage(client, headers) == (4000, 1)
+    assert client.delete("/api/delete/first.mp3", headers=headers).status_code == 404
+
+    media_id = db.query(_models.Media.id).filter_by(title="second.mp3").scalar()
+    _, other = make_user("other@example.com")
+    assert client.delete(f"/api/media/{media_id}/", headers=other).status_code == 404
+    assert usage(client, headers) == (4000, 1)
+
+    assert client.delete(f"/api/media/{media_id}/", headers=headers).status_code == 200
+    assert not storage.exists(f"id_{user.id}_media/second.mp3")
+    assert list(storage.list_objects(f"id_{user.id}_media/")) == []
+    assert usage(client, headers) == (0, 0)
+
+    # Deleted names can be uploaded again
+    assert upload(client, headers, "second.mp3").json()["uploaded_files"]
+    assert usage(client, headers) == (4000, 1)
+
+
+def test_delete_media_removes_cover(client, db, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    upload(client, headers, "song.mp3")
+    cover_key = f"id_{user.id}_media/song_cover.jpg"
+    storage.put(cover_key, io.BytesIO(b"jpeg"))
+    media = db.query(_models.Media).filter_by(title="song.mp3").one()
+    media.cover_image = f"users_media/{cover_key}"
+    db.commit()
+
+    assert client.delete(f"/api/media/{media.id}/", headers=headers).status_code == 200
+    assert not storage.exists(cover_key)
+
+
+def test_sweep_reconciles_usage(db, storage, make_user):
+    user, _ = make_user("owner@example.com")
+    storage.put(f"id_{user.id}_media/old.mp3", io.BytesIO(b"x" * 300))
+    db.add(_models.Media(title="old.mp3", users_id=user.id, length=1, size=None))
+    user.storage_used, user.track_count = 12345, -3
+    db.commit()
+
+    _main.cleanup_orphaned_entries()
+
+    db.expire_all()
+    assert db.query(_models.Media.size).filter_by(title="old.mp3").scalar() == 300
+    assert (user.storage_used, user.track_count) == (300, 1)
@@ -0,0 +1,134 @@
+import io
+
+import pytest
+
+from app.storage import LocalStorage, validate_key
+from app.storage.cache import ReadThroughCache
+
+
+class _Stream:
+    """A non-seekable upload stream, like the quota-limited reader."""
+    def __init__(self, data: bytes):
+        self.buffer = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.buffer.read(size)
+
+    def seekable(self) -> bool:
+        return False
+
+
+@pytest.fixture
+def s3_storage():
+    moto = pytest.importorskip("moto")
+    from app.storage.s3 import S3Storage
+
+    with moto.mock_aws():
+        storage = S3Storage(bucket="media", prefix="library", region_name="us-east-1")
+        storage.client.create_bucket(Bucket="media")
+        yield storage
+
+
+@pytest.fixture(params=["local", "s3"])
+def any_storage(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(str(tmp_path))
+    return request.getfixturevalue("s3_storage")
+
+
+def test_validate_key():
+    assert validate_key("id_1_media/song.mp3") == "id_1_media/song.mp3"
+    for key in ("", "/etc/passwd", "id_1_media/../id_2_media/song.mp3", "a//b", "a\\b"):
+        with pytest.raises(ValueError):
+            validate_key(key)
+
+
+def test_put_and_get_range(any_storage):
+    data = bytes(range(256)) * 1000
+    upload = io.BytesIO(data)
+    assert any_storage.put("id_1_media/song.mp3", upload) == len(data)
+    # Uploads are read again for their tags after they are stored
+    assert not upload.closed
+    assert any_storage.put("id_1_media/stream.mp3", _Stream(data)) == len(data)
+
+    assert b"".join(any_storage.get("id_1_media/song.mp3")) == data
+    assert b"".join(any_storage.get_range("id_1_media/stream.mp3", 100, 199, chunk_size=32)) == data[100:200]
+    assert b"".join(any_storage.get_range("id_1_media/song.mp3", len(data) - 10)) == data[-10:]
+    assert any_storage.size("id_1_media/song.mp3") == len(data)
+
+    assert any_storage.put("id_1_media/empty.mp3", io.BytesIO(b"")) == 0
+    assert b"".join(any_storage.get("id_1_media/empty.mp3")) == b""
+
+
+def test_cache_reads_empty_objects(s3_storage, tmp_path):
+    cache = ReadThroughCache(s3_storage, str(tmp_path / "cache"), max_bytes=1024)
+    s3_storage.put("id_1_media/empty.mp3", io.BytesIO(b""))
+    with open(cache.local_path("id_1_media/empty.mp3"), "rb") as file:
+        assert file.read() == b""
+
+
+def test_missing_and_delete(any_storage):
+    any_storage.put("id_1_media/song.mp3", io.BytesIO(b"data"))
+    assert any_storage.exists("id_1_media/song.mp3")
+    any_storage.delete("id_1_media/song.mp3")
+    any_storage.delete("id_1_media/song.mp3")
+    assert not any_storage.exists("id_1_media/song.mp3")
+    with pytest.raises(FileNotFoundError):
+        any_storage.get_range("id_1_media/song.mp3")
+    with pytest.raises(FileNotFoundError):
+        any_storage.size("id_1_media/song.mp3")
+
+
+def test_list_objects(any_storage):
+    any_storage.put("id_1_media/a.mp3", io.BytesIO(b"a"))
+    any_storage.put("id_1_media/b.mp3", io.BytesIO(b"bb"))
+    any_storage.put("id_11_media/c.mp3", io.BytesIO(b"ccc"))
+    assert sorted(any_storage.list_objects("id_1_media/")) == [("id_1_media/a.mp3", 1), ("id_1_media/b.mp3", 2)]
+    assert list(any_storage.list_objects("id_2_media")) == []
+
+
+def test_list_objects_includes_dot_files(any_storage):
+    any_storage.put("id_1_media/.song.mp3", io.BytesIO(b"a"))
+    assert list(any_storage.list_objects("id_1_media/")) == [("id_1_media/.song.mp3", 1)]
+
+
+def test_local_uploads_stay_out_of_the_key_namespace(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.put("id_1_media/song.mp3", io.BytesIO(b"a"))
+    assert sorted(path.name for path in tmp_path.iterdir()) == [".incoming", "id_1_media"]
+    assert list((tmp_path / ".incoming").iterdir()) == []
+    with pytest.raises(ValueError):
+        storage.put(".incoming/song.mp3", io.BytesIO(b"a"))
+
+
+def test_version_changes_on_replace(any_storage):
+    any_storage.put("id_1_media/song.mp3", io.BytesIO(b"first"))
+    version = any_storage.version("id_1_media/song.mp3")
+    any_storage.put("id_1_media/song.mp3", io.BytesIO(b"second version"))
+    assert any_storage.version("id_1_media/song.mp3") != version
+
+
+def test_cache_replicas_see_changes(s3_storage, tmp_path):
+    first = ReadThroughCache(s3_storage, str(tmp_path / "first"), max_bytes=1024 ** 2)
+    second = ReadThroughCache(s3_storage, str(tmp_path / "second"), max_bytes=1024 ** 2)
+
+    first.put("id_1_media/song.mp3", io.BytesIO(b"original"))
+    assert b"".join(second.get("id_1_media/song.mp3")) == b"original"
+
+    first.put("id_1_media/song.mp3", io.BytesIO(b"re-uploaded"))
+    assert b"".join(second.get("id_1_media/song.mp3")) == b"re-uploaded"
+    assert second.size("id_1_media/song.mp3") == len(b"re-uploaded")
+
+    first.delete("id_1_media/song.mp3")
+    with pytest.raises(FileNotFoundError):
+        second.local_path("id_1_media/song.mp3")
+    assert not second.exists("id_1_media/song.mp3")
+
+
+def test_cache_is_trimmed(s3_storage, tmp_path):
+    cache = ReadThroughCache(s3_storage, str(tmp_path / "cache"), max_bytes=1500)
+    for name in ("a", "b", "c"):
+        s3_storage.put(f"id_1_media/{name}.mp3", io.BytesIO(b"x" * 1000))
+        cache.local_path(f"id_1_media/{name}.mp3")
+    cached = [path for path in (tmp_path / "cache" / "id_1_media").iterdir()]
+    assert len(cached) == 1 and cached[0].name.startswith("c.mp3~")
@@ -0,0 +1,92 @@
+import io
+from urllib.parse import parse_qs, urlsplit
+
+import fastapi
+import pytest
+
+from app.database import services as _services
+from app.main import parse_range
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=-", None),
+    ("items=0-10", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(fastapi.HTTPException) as error:
+        parse_range(header, 1000)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_stream_signature():
+    params = _services.create_stream_signature("id_1_media/song.mp3", 1000)
+    assert _services.verify_stream_signature("id_1_media/song.mp3", 1000, params["expires"], params["signature"])
+    assert not _services.verify_stream_signature("id_2_media/song.mp3", 1000, params["expires"], params["signature"])
+    assert not _services.verify_stream_signature("id_1_media/song.mp3", 1001, params["expires"], params["signature"])
+    assert not _services.verify_stream_signature("id_1_media/song.mp3", 1000, params["expires"] + 1, params["signature"])
+
+
+def test_stream_signature_expires(monkeypatch):
+    monkeypatch.setattr(_services, "STREAM_URL_TTL", -1)
+    params = _services.create_stream_signature("id_1_media/song.mp3", 1000)
+    assert not _services.verify_stream_signature("id_1_media/song.mp3", 1000, params["expires"], params["signature"])
+
+
+@pytest.fixture
+def stream_url(client, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    client.post("/api/upload/", files={"files": ("song.mp3", DATA)}, headers=headers)
+    media_id = client.get("/api/media/", headers=headers).json()[0]["id"]
+    response = client.get(f"/api/media/{media_id}/stream-url", headers=headers)
+    assert response.status_code == 200
+    return response.json()["url"]
+
+
+def test_stream_ranges(client, stream_url):
+    response = client.get(stream_url)
+    assert response.status_code == 200
+    assert response.content == DATA
+
+    response = client.get(stream_url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.content == DATA[100:200]
+
+    assert client.get(stream_url, headers={"Range": f"bytes={len(DATA)}-"}).status_code == 416
+
+
+def test_stream_rejects_tampered_urls(client, stream_url):
+    url = urlsplit(stream_url)
+    params = {name: values[0] for name, values in parse_qs(url.query).items()}
+    other_key = url.path.replace("song.mp3", "other.mp3")
+    assert client.get(f"{other_key}?{url.query}").status_code == 403
+    params["size"] = str(int(params["size"]) + 1)
+    tampered = "&".join(f"{name}={value}" for name, value in params.items())
+    assert client.get(f"{url.path}?{tampered}").status_code == 403
+
+
+def test_users_media_only_serves_covers(client, storage, make_user):
+    user, headers = make_user("owner@example.com")
+    client.post("/api/upload/", files={"files": ("song.mp3", DATA)}, headers=headers)
+    storage.put(f"id_{user.id}_media/song_cover.jpg", io.BytesIO(b"jpeg"))
+
+    assert client.get(f"/users_media/id_{user.id}_media/song.mp3").status_code == 404
+    response = client.get(f"/users_media/id_{user.id}_media/song_cover.jpg")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.content == b"jpeg"
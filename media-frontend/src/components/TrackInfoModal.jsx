@@ -1,13 +1,32 @@
-import React, { useContext } from "react";
+import React, { useContext, useEffect, useState } from "react";
 import { UserContext } from "../context/UserContext";
 
 const TrackInfoModal = ({ track, onClose }) => {
     const [token] = useContext(UserContext);
+    const [mediaUrl, setMediaUrl] = useState(null);
+
+    // Request a short-lived signed URL so the token never ends up in the audio src
+    useEffect(() => {
+        if (!track) return;
+        const getStreamUrl = async () => {
+            const requestOptions = {
+                method: "GET",
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            };
+            const response = await fetch(`/api/media/${track.id}/stream-url`, requestOptions);
+            if (response.ok) {
+                const data = await response.json();
+                setMediaUrl(`${window.location.origin}${data.url}`);
+            }
+        };
+        getStreamUrl();
+    }, [track, token]);
 
     if (!track) return null;
 
-    // Construct the full URL for the media file and cover image
-    const mediaUrl = `${window.location.origin}/api/stream/${track.title}?token=${token}`;
+    // Construct the full URL for the cover image
     const coverImageUrl = `${window.location.origin}/${track.cover_image}`;
 
     return (
@@ -20,10 +39,12 @@ const TrackInfoModal = ({ track, onClose }) => {
                     <p><strong>Album:</strong> {track.album_name}</p>
                     <p><strong>Genre:</strong> {track.genre}</p>
                     <img src={coverImageUrl} alt="Cover" style={{ width: '100%' }} />
-                    <audio controls style={{ width: '100%' }}>
-                        <source src={mediaUrl} type="audio/mpeg" />
-                        Your browser does not support the audio element.
-                    </audio>
+                    {mediaUrl && (
+                        <audio controls style={{ width: '100%' }}>
+                            <source src={mediaUrl} type="audio/mpeg" />
+                            Your browser does not support the audio element.
+                        </audio>
+                    )}
                     <button className="button is-primary mt-3" onClick={onClose}>Close</button>
                 </div>
             </div>